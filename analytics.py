@@ -0,0 +1,280 @@
+"""
+FILE: analytics.py
+------------------
+Price and bidding statistics computed off the database. export() copies
+Items, Categories and Bids out of AuctionBase.db once, into columnar NumPy
+arrays saved as .npy files in a directory, with times as epoch seconds and
+amounts as integer cents in either schema. load() maps them back into
+memory, and the statistics below are computed over the arrays with
+vectorized NumPy operations, so analysts do not run GROUP BY queries
+against the database the site is serving from:
+
+  categories   distribution of the current price of the items in each
+               category that have bids
+  increments   how much each bid raised the price over the previous bid
+               (or over the first bid, for the first one)
+  sellthrough  share of ended auctions that sold and that were bought out,
+               for auctions without a buy price and by buy price band
+  hourly       number of bids placed in each hour
+
+Each export is a snapshot; export again to pick up newer bids.
+
+NumPy is only needed by this module; the rest of AuctionBase does not use it.
+
+Usage: python analytics.py export [--db AuctionBase.db] [--out analytics]
+       python analytics.py report [--data analytics]
+                                  [categories|increments|sellthrough|hourly ...]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+import loader
+
+DATA_DIR = 'analytics'
+META_FILE = 'meta.json'
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+REPORTS = ('categories', 'increments', 'sellthrough', 'hourly')
+
+# Quantiles given for every distribution
+QUANTILES = (0.25, 0.5, 0.75, 0.9)
+
+# Number of buy price bands in the sell-through report
+BUY_PRICE_BANDS = 5
+
+def requireNumpy():
+    if np is None:
+        raise ImportError('analytics.py needs numpy (pip install numpy)')
+
+# SQL expressions that read a stored time as epoch seconds and a stored
+# amount as cents; a missing amount becomes -1
+def secondsColumn(column, compact):
+    return column if compact else "CAST(strftime('%%s', %s) AS INTEGER)" % column
+
+def centsColumn(column, compact):
+    amount = column if compact else 'CAST(ROUND(%s * 100) AS INTEGER)' % column
+    return 'COALESCE(%s, -1)' % amount
+
+def fetchArray(conn, query_string, columns):
+    rows = conn.execute(query_string).fetchall()
+    return np.array(rows, dtype = np.int64).reshape(len(rows), columns)
+
+# Writes the arrays of db_file into out_dir and returns the number of items,
+# category entries and bids exported. Items are in ItemID order; bids and
+# category entries refer to items by their position in that order.
+def export(db_file = loader.DATABASE, out_dir = DATA_DIR):
+    requireNumpy()
+    conn = loader.connect(db_file)
+    try:
+        compact = loader.isCompact(conn)
+        conn.execute('BEGIN')
+        items = fetchArray(conn, 'SELECT ItemID, %s, %s, %s, Number_of_Bids, %s, %s FROM Items ORDER BY ItemID' % (
+            centsColumn('First_Bid', compact), centsColumn('Currently', compact), centsColumn('Buy_Price', compact),
+            secondsColumn('Started', compact), secondsColumn('Ends', compact)), 7)
+        categories = [row[0] for row in conn.execute('SELECT DISTINCT Category FROM Categories ORDER BY Category')]
+        codes = dict((category, code) for code, category in enumerate(categories))
+        entries = conn.execute('SELECT ItemID, Category FROM Categories ORDER BY ItemID').fetchall()
+        bids = fetchArray(conn, 'SELECT ItemID, %s, %s FROM Bids ORDER BY ItemID, Time' % (
+            secondsColumn('Time', compact), centsColumn('Amount', compact)), 3)
+        now = conn.execute('SELECT %s FROM CurrentTime' % secondsColumn('Time', compact)).fetchone()[0]
+        conn.execute('COMMIT')
+    finally:
+        conn.close()
+
+    itemIDs = items[:, 0]
+    arrays = {
+        'item_id': itemIDs,
+        'first_bid': items[:, 1],
+        'currently': items[:, 2],
+        'buy_price': items[:, 3],
+        'number_of_bids': items[:, 4].astype(np.int32),
+        'started': items[:, 5],
+        'ends': items[:, 6],
+        'category_item': np.searchsorted(itemIDs, np.array([entry[0] for entry in entries], dtype = np.int64)).astype(np.int32),
+        'category_code': np.array([codes[entry[1]] for entry in entries], dtype = np.int32),
+        'bid_item': np.searchsorted(itemIDs, bids[:, 0]).astype(np.int32),
+        'bid_time': bids[:, 1],
+        'bid_amount': bids[:, 2],
+    }
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+    for name, array in arrays.items():
+        np.save(os.path.join(out_dir, name + '.npy'), np.ascontiguousarray(array))
+    with open(os.path.join(out_dir, META_FILE), 'w') as f:
+        json.dump({'categories': categories, 'now': now, 'exported': int(time.time()), 'database': os.path.abspath(db_file)}, f)
+    return len(itemIDs), len(entries), len(bids)
+
+# The exported arrays, as attributes, plus categories (the names that
+# category_code indexes) and now (the current time when exported)
+class AuctionData(object):
+    def __init__(self, data_dir = DATA_DIR, mmap = True):
+        requireNumpy()
+        with open(os.path.join(data_dir, META_FILE)) as f:
+            meta = json.load(f)
+        self.categories = meta['categories']
+        self.now = meta['now']
+        for file_name in os.listdir(data_dir):
+            if file_name.endswith('.npy'):
+                setattr(self, file_name[:-4], np.load(os.path.join(data_dir, file_name), mmap_mode = 'r' if mmap else None))
+
+def load(data_dir = DATA_DIR, mmap = True):
+    return AuctionData(data_dir, mmap)
+
+#####################STATISTICS#####################
+
+# Quantiles of values within groups: sortedValues is sorted by group and then
+# by value, and counts gives the size of each group. The values given for
+# empty groups mean nothing.
+def groupQuantiles(sortedValues, counts, quantiles = QUANTILES):
+    starts = np.cumsum(counts) - counts
+    last = np.maximum(counts, 1) - 1
+    return [sortedValues[np.minimum(starts + (last * q).astype(np.int64), len(sortedValues) - 1)] for q in quantiles]
+
+def dollars(cents):
+    return cents / 100.0
+
+def categoryPrices(data):
+    hasBids = data.number_of_bids[data.category_item] > 0
+    codes = data.category_code[hasBids]
+    prices = data.currently[data.category_item[hasBids]]
+    if len(prices) == 0:
+        return []
+    order = np.lexsort((prices, codes))
+    codes, prices = codes[order], prices[order]
+    counts = np.bincount(codes, minlength = len(data.categories))
+    totals = np.bincount(codes, weights = prices, minlength = len(data.categories))
+    starts = np.cumsum(counts) - counts
+    quantiles = groupQuantiles(prices, counts)
+    result = []
+    for code in np.nonzero(counts)[0]:
+        first, last = starts[code], starts[code] + counts[code] - 1
+        row = {'category': data.categories[code], 'items': int(counts[code]),
+               'min': dollars(prices[first]), 'max': dollars(prices[last]), 'mean': dollars(totals[code] / counts[code])}
+        for q, values in zip(QUANTILES, quantiles):
+            row['p%d' % (q * 100)] = dollars(values[code])
+        result.append(row)
+    return result
+
+# Raises of every bid over the one before it on the same item (the first bid
+# of an item is compared with its First_Bid), in dollars and as a fraction of
+# the previous amount
+def bidIncrements(data):
+    amounts = data.bid_amount
+    if len(amounts) == 0:
+        return {'bids': 0}
+    previous = np.empty_like(amounts)
+    previous[1:] = amounts[:-1]
+    firstOfItem = np.ones(len(amounts), dtype = bool)
+    firstOfItem[1:] = data.bid_item[1:] != data.bid_item[:-1]
+    previous[firstOfItem] = data.first_bid[data.bid_item[firstOfItem]]
+    raises = np.sort(amounts - previous)
+    relative = np.sort((amounts - previous) / np.maximum(previous, 1).astype(np.float64))
+    result = {'bids': len(raises), 'mean': dollars(raises.mean()), 'max': dollars(raises[-1])}
+    for q in QUANTILES:
+        result['p%d' % (q * 100)] = dollars(raises[int((len(raises) - 1) * q)])
+        result['relative_p%d' % (q * 100)] = float(relative[int((len(relative) - 1) * q)])
+    return result
+
+# Share of ended auctions (ended by time or bought out) that got bids, and
+# that were bought out, for auctions without a buy price and for each band of
+# buy prices; the bands hold about the same number of auctions
+def sellThrough(data, bands = BUY_PRICE_BANDS):
+    hasBuyPrice = data.buy_price >= 0
+    boughtOut = hasBuyPrice & (data.currently >= data.buy_price) & (data.number_of_bids > 0)
+    ended = (data.ends <= data.now) | boughtOut
+    sold = data.number_of_bids > 0
+    result = []
+
+    def band(name, mask):
+        auctions = int(mask.sum())
+        if auctions:
+            result.append({'band': name, 'auctions': auctions, 'sold': float(sold[mask].mean()),
+                           'bought_out': float(boughtOut[mask].mean())})
+
+    band('no buy price', ended & ~hasBuyPrice)
+    buyPrices = np.sort(data.buy_price[ended & hasBuyPrice])
+    if len(buyPrices):
+        edges = buyPrices[(np.arange(1, bands) * len(buyPrices)) // bands]
+        which = np.searchsorted(edges, data.buy_price, side = 'right')
+        bounds = np.concatenate(([buyPrices[0]], edges, [buyPrices[-1]]))
+        for i in range(bands):
+            band('$%.2f - $%.2f' % (dollars(bounds[i]), dollars(bounds[i + 1])), ended & hasBuyPrice & (which == i))
+    return result
+
+# Bids placed in each hour from the first bid to the last (or between since
+# and until, as epoch seconds), as a list of (hour, count)
+def bidsPerHour(data, since = None, until = None):
+    times = data.bid_time
+    if since is not None or until is not None:
+        mask = np.ones(len(times), dtype = bool)
+        if since is not None:
+            mask &= times >= since
+        if until is not None:
+            mask &= times < until
+        times = times[mask]
+    if len(times) == 0:
+        return []
+    hours = times // 3600
+    first = int(hours.min())
+    counts = np.bincount(hours - first)
+    return [(time.strftime(TIME_FORMAT, time.gmtime((first + i) * 3600)), int(count)) for i, count in enumerate(counts)]
+
+#####################REPORTS#####################
+
+def printCategories(data):
+    columns = ['p%d' % (q * 100) for q in QUANTILES]
+    print('%-30s %8s %10s %s %10s %10s' % ('category', 'items', 'min', ' '.join('%10s' % c for c in columns), 'max', 'mean'))
+    for row in categoryPrices(data):
+        print('%-30s %8d %10.2f %s %10.2f %10.2f' % (row['category'][:30], row['items'], row['min'],
+                                                     ' '.join('%10.2f' % row[c] for c in columns), row['max'], row['mean']))
+
+def printIncrements(data):
+    stats = bidIncrements(data)
+    for key in sorted(stats):
+        print('%-16s %s' % (key, stats[key]))
+
+def printSellThrough(data):
+    print('%-24s %10s %8s %11s' % ('buy price', 'auctions', 'sold', 'bought out'))
+    for row in sellThrough(data):
+        print('%-24s %10d %7.1f%% %10.1f%%' % (row['band'], row['auctions'], row['sold'] * 100, row['bought_out'] * 100))
+
+def printHourly(data):
+    for hour, count in bidsPerHour(data):
+        print('%s %d' % (hour, count))
+
+REPORT_FUNCTIONS = {'categories': printCategories, 'increments': printIncrements,
+                    'sellthrough': printSellThrough, 'hourly': printHourly}
+
+def main(argv):
+    argParser = argparse.ArgumentParser(description = 'Export AuctionBase to NumPy arrays and report statistics on them.')
+    commands = argParser.add_subparsers(dest = 'command')
+    exportParser = commands.add_parser('export', help = 'export the database to arrays')
+    exportParser.add_argument('--db', default = loader.DATABASE, help = 'database file to export')
+    exportParser.add_argument('--out', default = DATA_DIR, help = 'directory to write the arrays to')
+    reportParser = commands.add_parser('report', help = 'print statistics over exported arrays')
+    reportParser.add_argument('--data', default = DATA_DIR, help = 'directory of exported arrays')
+    reportParser.add_argument('reports', nargs = '*', help = 'reports to print: %s (default all)' % ', '.join(REPORTS))
+    args = argParser.parse_args(argv[1:])
+    if args.command == 'export':
+        print('exported %d items, %d category entries and %d bids' % export(args.db, args.out))
+    elif args.command == 'report':
+        unknown = [report for report in args.reports if report not in REPORTS]
+        if unknown:
+            argParser.error('unknown report %s' % ', '.join(unknown))
+        data = load(args.data)
+        for report in args.reports or REPORTS:
+            print('== %s' % report)
+            REPORT_FUNCTIONS[report](data)
+    else:
+        argParser.print_help()
+
+if __name__ == '__main__':
+    main(sys.argv)
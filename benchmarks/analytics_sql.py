@@ -0,0 +1,97 @@
+"""
+FILE: benchmarks/analytics_sql.py
+------------------
+Compares the statistics of analytics.py, computed over exported NumPy
+arrays, with the SQL an analyst would otherwise run against AuctionBase.db
+for the same figures (GROUP BY and window functions). Builds a database
+from generated json files, exports it once, and reports the best of
+--repeat runs of each.
+
+Usage: python benchmarks/analytics_sql.py [--items N] [--repeat N]
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import analytics
+import loader
+from generate_items import generate
+
+# The statistics as SQL on the text schema, one statement each
+CATEGORY_SQL = """SELECT Category, COUNT(*), MIN(Price), MAX(Price), AVG(Price),
+    MIN(CASE WHEN Position >= (Total - 1) * 0.25 THEN Price END),
+    MIN(CASE WHEN Position >= (Total - 1) * 0.5 THEN Price END),
+    MIN(CASE WHEN Position >= (Total - 1) * 0.75 THEN Price END),
+    MIN(CASE WHEN Position >= (Total - 1) * 0.9 THEN Price END)
+    FROM (SELECT Category, Items.Currently AS Price,
+                 ROW_NUMBER() OVER (PARTITION BY Category ORDER BY Items.Currently) - 1 AS Position,
+                 COUNT(*) OVER (PARTITION BY Category) AS Total
+          FROM Categories JOIN Items ON Items.ItemID = Categories.ItemID
+          WHERE Items.Number_of_Bids > 0)
+    GROUP BY Category"""
+INCREMENT_SQL = """SELECT COUNT(*), AVG(Increase), MAX(Increase) FROM
+    (SELECT Bids.Amount - COALESCE(LAG(Bids.Amount) OVER (PARTITION BY Bids.ItemID ORDER BY Bids.Time),
+                                   Items.First_Bid) AS Increase
+     FROM Bids JOIN Items ON Items.ItemID = Bids.ItemID)"""
+SELL_THROUGH_SQL = """SELECT Band, COUNT(*), AVG(Number_of_Bids > 0), AVG(Buy_Price IS NOT NULL AND Currently >= Buy_Price)
+    FROM (SELECT Items.*, CASE WHEN Buy_Price IS NULL THEN -1
+                               ELSE NTILE(5) OVER (PARTITION BY Buy_Price IS NULL ORDER BY Buy_Price) END AS Band
+          FROM Items, CurrentTime WHERE Ends <= CurrentTime.Time OR Currently >= Buy_Price)
+    GROUP BY Band"""
+HOURLY_SQL = "SELECT strftime('%Y-%m-%d %H:00:00', Time) AS Hour, COUNT(*) FROM Bids GROUP BY Hour ORDER BY Hour"
+
+STATISTICS = (
+    ('categories', CATEGORY_SQL, analytics.categoryPrices),
+    ('increments', INCREMENT_SQL, analytics.bidIncrements),
+    ('sellthrough', SELL_THROUGH_SQL, analytics.sellThrough),
+    ('hourly', HOURLY_SQL, analytics.bidsPerHour),
+)
+
+def best(function, repeat):
+    times = []
+    for i in range(repeat):
+        start = time.time()
+        function()
+        times.append(time.time() - start)
+    return min(times)
+
+def main(argv):
+    argParser = argparse.ArgumentParser(description = 'Compare analytics.py with the equivalent SQL.')
+    argParser.add_argument('--items', type = int, default = 100000, help = 'number of generated items')
+    argParser.add_argument('--repeat', type = int, default = 3, help = 'runs of each statistic')
+    options = argParser.parse_args(argv[1:])
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        json_files = generate(os.path.join(work_dir, 'json'), items = options.items)
+        db_file = os.path.join(work_dir, 'AuctionBase.db')
+        stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+        try:
+            loader.loadDatabase(json_files, db_file)
+        finally:
+            sys.stdout = stdout
+        data_dir = os.path.join(work_dir, 'analytics')
+        start = time.time()
+        items, entries, bids = analytics.export(db_file, data_dir)
+        print('exported %d items and %d bids in %.2fs' % (items, bids, time.time() - start))
+        data = analytics.load(data_dir, mmap = False)
+
+        conn = loader.connect(db_file)
+        print('%12s %10s %10s %9s' % ('statistic', 'sql ms', 'numpy ms', 'speedup'))
+        for name, query_string, function in STATISTICS:
+            sqlSeconds = best(lambda: conn.execute(query_string).fetchall(), options.repeat)
+            numpySeconds = best(lambda: function(data), options.repeat)
+            print('%12s %10.1f %10.1f %8.0fx' % (name, sqlSeconds * 1000, numpySeconds * 1000, sqlSeconds / numpySeconds))
+        conn.close()
+    finally:
+        shutil.rmtree(work_dir)
+
+if __name__ == '__main__':
+    main(sys.argv)
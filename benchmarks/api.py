@@ -0,0 +1,177 @@
+"""
+FILE: benchmarks/api.py
+------------------
+Throughput of the JSON API against the HTML pages it mirrors. Builds a
+database from generated json files, starts web.py/serve.py on it (as
+load.py does) and, for each operation, sends the same kind of request
+through every route that offers it for --duration seconds:
+
+  item    GET /items, GET /api/items and POST /api/items/batch
+  search  POST /search and GET /api/search
+  bid     POST /add_bid, POST /api/bid and POST /api/bids/batch
+
+Batch requests carry --batch item IDs or bids. The table gives requests and
+operations (items, searches or bids) per second for each route, with
+--concurrency clients sending one request at a time.
+
+Usage: python benchmarks/api.py [--items N] [--duration SECONDS]
+                                [--concurrency N] [--batch N]
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+try:
+    import http.client as httplib
+    from urllib.parse import urlencode
+except ImportError:
+    import httplib
+    from urllib import urlencode
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+import loader
+from bids import startMidway
+from generate_items import generate
+from load import SERVER, bidRequest, freePort, readTargets, searchRequest, waitForServer
+
+FORM = {'Content-Type': 'application/x-www-form-urlencoded'}
+JSON = {'Content-Type': 'application/json'}
+
+# Each route returns (method, path, body, headers, operations) for a random request
+
+def htmlItem(targets, rnd, batch):
+    return 'GET', '/items?' + urlencode({'id': rnd.choice(targets['items'])}), None, {}, 1
+
+def apiItem(targets, rnd, batch):
+    return 'GET', '/api/items?' + urlencode({'id': rnd.choice(targets['items'])}), None, {}, 1
+
+def apiItemBatch(targets, rnd, batch):
+    return 'POST', '/api/items/batch', json.dumps([rnd.choice(targets['items']) for i in range(batch)]), JSON, batch
+
+def htmlSearch(targets, rnd, batch):
+    method, path, params = searchRequest(targets, rnd)
+    return method, path, urlencode(params), FORM, 1
+
+def apiSearch(targets, rnd, batch):
+    method, path, params = searchRequest(targets, rnd)
+    return 'GET', '/api/search?' + urlencode(params), None, {}, 1
+
+def htmlBid(targets, rnd, batch):
+    method, path, params = bidRequest(targets, rnd)
+    return method, path, urlencode(params), FORM, 1
+
+def apiBid(targets, rnd, batch):
+    method, path, params = bidRequest(targets, rnd)
+    return 'POST', '/api/bid', json.dumps(params), JSON, 1
+
+def apiBidBatch(targets, rnd, batch):
+    bids = [bidRequest(targets, rnd)[2] for i in range(batch)]
+    return 'POST', '/api/bids/batch', json.dumps(bids), JSON, batch
+
+ROUTES = (
+    ('item', 'GET /items', htmlItem),
+    ('item', 'GET /api/items', apiItem),
+    ('item', 'POST /api/items/batch', apiItemBatch),
+    ('search', 'POST /search', htmlSearch),
+    ('search', 'GET /api/search', apiSearch),
+    ('bid', 'POST /add_bid', htmlBid),
+    ('bid', 'POST /api/bid', apiBid),
+    ('bid', 'POST /api/bids/batch', apiBidBatch),
+)
+
+# Sends one request, reads the whole response and returns its status (0 if
+# the connection failed)
+def send(port, method, path, body, headers):
+    conn = httplib.HTTPConnection('127.0.0.1', port, timeout = 60)
+    try:
+        conn.request(method, path, body, headers)
+        response = conn.getresponse()
+        response.read()
+        return response.status
+    except (socket.error, httplib.HTTPException):
+        return 0
+    finally:
+        conn.close()
+
+# Sends requests made by route from concurrency threads for duration seconds
+# and returns the number of requests, operations and errors
+def measure(port, route, targets, options):
+    targets['started'] = time.time()
+    deadline = targets['started'] + options.duration
+    totals = [0, 0, 0]
+    lock = threading.Lock()
+
+    def client(seed):
+        rnd = random.Random(seed)
+        requests = operations = errors = 0
+        while time.time() < deadline:
+            method, path, body, headers, count = route(targets, rnd, options.batch)
+            if send(port, method, path, body, headers) == 200:
+                requests += 1
+                operations += count
+            else:
+                errors += 1
+        with lock:
+            totals[0] += requests
+            totals[1] += operations
+            totals[2] += errors
+
+    clients = [threading.Thread(target = client, args = (random.random(),)) for i in range(options.concurrency)]
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    return totals
+
+def main(argv):
+    argParser = argparse.ArgumentParser(description = 'Compare the throughput of the JSON API and the HTML pages.')
+    argParser.add_argument('--items', type = int, default = 20000, help = 'number of generated items')
+    argParser.add_argument('--duration', type = float, default = 5, help = 'seconds per route')
+    argParser.add_argument('--concurrency', type = int, default = 4, help = 'clients sending requests')
+    argParser.add_argument('--batch', type = int, default = 100, help = 'item IDs or bids per batch request')
+    argParser.add_argument('--threads', type = int, default = 16, help = 'server worker threads')
+    options = argParser.parse_args(argv[1:])
+
+    work_dir = tempfile.mkdtemp()
+    server = None
+    try:
+        json_files = generate(os.path.join(work_dir, 'json'), items = options.items)
+        db_file = os.path.join(work_dir, 'AuctionBase.db')
+        stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+        try:
+            loader.loadDatabase(json_files, db_file)
+        finally:
+            sys.stdout = stdout
+        startMidway(db_file)
+        targets = readTargets(db_file)
+
+        port = freePort()
+        server = subprocess.Popen([sys.executable, SERVER, '--host', '127.0.0.1', '--port', str(port),
+                                   '--threads', str(options.threads)],
+                                  cwd = work_dir, stdout = open(os.devnull, 'w'))
+        waitForServer(port, server)
+        print('%8s %24s %10s %14s %8s' % ('op', 'route', 'req/sec', 'ops/sec', 'errors'))
+        for operation, name, route in ROUTES:
+            requests, operations, errors = measure(port, route, targets, options)
+            print('%8s %24s %10.1f %14.1f %8d' % (operation, name, requests / options.duration,
+                                                operations / options.duration, errors))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        shutil.rmtree(work_dir)
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,181 @@
+"""
+FILE: benchmarks/bids.py
+------------------
+Bid throughput benchmark. Builds a database from generated json files and
+places bids on many open auctions through two paths:
+
+  legacy  the checks place_bid.POST used to make (getUserById, getItemById
+          and getTime, then sqlitedb.newBid, which reads the time again),
+          against the original triggers 2 to 8
+  engine  sqlitedb.placeBid, which reads everything it checks with one
+          query, against the consolidated triggers of bid_add.sql
+
+The clock is set to the middle of the generated auctions first. Every round
+moves the clock forward one second (Bids allows one bid per item per second)
+and then places one accepted and one rejected (too small) bid on each item;
+only the bids are timed. Each path runs in a fresh process on its own copy
+of the database.
+
+Every accepted bid is its own transaction, so with the default
+synchronous=FULL the commits dominate; --synchronous OFF leaves out the
+fsyncs to compare the work done per bid.
+
+Usage: python benchmarks/bids.py [--items N] [--auctions N] [--rounds N]
+                                 [--synchronous OFF|NORMAL|FULL]
+"""
+
+import argparse
+import calendar
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+import loader
+from generate_items import generate
+
+PATHS = ('legacy', 'engine')
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Bids as place_bid.POST checked them before sqlitedb.placeBid
+def legacyBid(sqlitedb, userID, itemID, Amount):
+    curr_user = sqlitedb.getUserById(userID)
+    curr_item = sqlitedb.getItemById(itemID)
+    amount = sqlitedb.moneyToDb(Amount)
+    current_time = sqlitedb.getTime()
+    if curr_user is None or curr_item is None or curr_user.UserID == curr_item.Seller_UserID:
+        return False
+    if amount < 0 or amount <= curr_item.First_Bid or amount <= curr_item.Currently:
+        return False
+    if current_time < curr_item.Started or sqlitedb.getTime() >= curr_item.Ends:
+        return False
+    return sqlitedb.newBid(userID, itemID, Amount)
+
+def engineBid(sqlitedb, userID, itemID, Amount):
+    outcome, item, added = sqlitedb.placeBid(userID, itemID, Amount)
+    return added
+
+BID_FUNCTIONS = {'legacy': legacyBid, 'engine': engineBid}
+
+# Generated auctions are spread over most of 2001 and have all ended by the
+# default current time, so the clock is set back to the median start time
+# (with trigger1, which stops it moving backwards, dropped meanwhile) and the
+# stored statuses, settlements and category facets are rebuilt
+def startMidway(db_file):
+    conn = loader.connect(db_file)
+    conn.execute('DROP TRIGGER trigger1')
+    conn.execute('UPDATE CurrentTime SET Time = (SELECT Started FROM Items ORDER BY Started '
+                 'LIMIT 1 OFFSET (SELECT COUNT(*) / 2 FROM Items))')
+    for script_file in (loader.TRIGGER_FILES[0], loader.STATUS_FILE, loader.SETTLEMENT_FILE, loader.FACET_FILE):
+        loader.runScript(conn, script_file)
+    conn.close()
+
+# Swaps the consolidated bid triggers for the original triggers 2 to 8
+def useLegacyTriggers(db_file):
+    conn = loader.connect(db_file)
+    loader.runScript(conn, os.path.join(loader.SQL_DIR, 'bid_drop.sql'))
+    for script_file in loader.TRIGGER_FILES[1:-1]:
+        loader.runScript(conn, script_file)
+    conn.close()
+
+# Picks open auctions without a buy price that stay open for the whole run,
+# with a bidder other than the seller for each
+def pickAuctions(sqlitedb, auctions, rounds):
+    now = sqlitedb.getTime()
+    items = sqlitedb.query('select Items.ItemID, Items.Seller_UserID, Items.Currently, Items.Ends from Items '
+                           'join ItemStatus on ItemStatus.ItemID = Items.ItemID '
+                           "where ItemStatus.Status = 'open' and Items.Buy_Price is null order by Items.ItemID")
+    users = [user.UserID for user in sqlitedb.query('select UserID from Users limit 2')]
+    picked = []
+    for item in items:
+        end = calendar.timegm(time.strptime(str(sqlitedb.timeFromDb(item.Ends)), TIME_FORMAT))
+        start = calendar.timegm(time.strptime(str(sqlitedb.timeFromDb(now)), TIME_FORMAT))
+        if end > start + rounds:
+            bidder = users[0] if users[0] != item.Seller_UserID else users[1]
+            picked.append([item.ItemID, bidder, float(sqlitedb.moneyFromDb(item.Currently))])
+        if len(picked) == auctions:
+            break
+    return picked
+
+# Runs one path in the current process, in db_dir, and returns the seconds
+# spent on accepted bids, the seconds spent on rejected bids and the number
+# of bids of each kind
+def measure(path, db_dir, auctions, rounds, synchronous):
+    os.chdir(db_dir)
+    sys.path.insert(0, os.path.join(ROOT, 'web.py'))
+    import sqlitedb
+    sqlitedb.db.printing = False
+    sqlitedb.enforceForeignKey()
+    sqlitedb.db.query('PRAGMA synchronous = ' + synchronous)
+    bid = BID_FUNCTIONS[path]
+    picked = pickAuctions(sqlitedb, auctions, rounds)
+    accepted = rejected = 0.0
+    count = 0
+    for i in range(rounds):
+        now = calendar.timegm(time.strptime(str(sqlitedb.timeFromDb(sqlitedb.getTime())), TIME_FORMAT))
+        sqlitedb.updateTime(time.strftime(TIME_FORMAT, time.gmtime(now + 1)))
+        start = time.time()
+        for item in picked:
+            item[2] += 1
+            if not bid(sqlitedb, item[1], item[0], '%.2f' % item[2]):
+                raise Exception('bid on item %s was rejected' % item[0])
+        accepted += time.time() - start
+        start = time.time()
+        for item in picked:
+            if bid(sqlitedb, item[1], item[0], '%.2f' % (item[2] - 0.5)):
+                raise Exception('too small bid on item %s was accepted' % item[0])
+        rejected += time.time() - start
+        count += len(picked)
+    return accepted, rejected, count
+
+def measureInChild(path, db_dir, options):
+    output = subprocess.check_output([sys.executable, os.path.abspath(__file__), '--child', path, '--db-dir', db_dir,
+                                      '--auctions', str(options.auctions), '--rounds', str(options.rounds),
+                                      '--synchronous', options.synchronous])
+    accepted, rejected, count = output.split()
+    return float(accepted), float(rejected), int(count)
+
+def main(argv):
+    argParser = argparse.ArgumentParser(description = 'Benchmark bids per second through the old and new bid paths.')
+    argParser.add_argument('--items', type = int, default = 50000, help = 'number of generated items')
+    argParser.add_argument('--auctions', type = int, default = 500, help = 'number of open auctions bid on')
+    argParser.add_argument('--rounds', type = int, default = 10, help = 'bids per auction')
+    argParser.add_argument('--synchronous', choices = ('OFF', 'NORMAL', 'FULL'), default = 'FULL',
+                           help = 'PRAGMA synchronous for the bids')
+    argParser.add_argument('--child', choices = PATHS, help = argparse.SUPPRESS)
+    argParser.add_argument('--db-dir', dest = 'dbDir', help = argparse.SUPPRESS)
+    options = argParser.parse_args(argv[1:])
+    if options.child:
+        print('%f %f %d' % measure(options.child, options.dbDir, options.auctions, options.rounds, options.synchronous))
+        return
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        json_files = generate(os.path.join(work_dir, 'json'), items = options.items)
+        db_file = os.path.join(work_dir, 'AuctionBase.db')
+        stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+        try:
+            loader.loadDatabase(json_files, db_file)
+        finally:
+            sys.stdout = stdout
+        startMidway(db_file)
+        print('%8s %8s %14s %14s' % ('path', 'bids', 'accepted/sec', 'rejected/sec'))
+        for path in PATHS:
+            db_dir = os.path.join(work_dir, path)
+            os.mkdir(db_dir)
+            shutil.copy(db_file, db_dir)
+            if path == 'legacy':
+                useLegacyTriggers(os.path.join(db_dir, 'AuctionBase.db'))
+            accepted, rejected, count = measureInChild(path, db_dir, options)
+            print('%8s %8d %14.0f %14.0f' % (path, count, count / accepted, count / rejected))
+    finally:
+        shutil.rmtree(work_dir)
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,159 @@
+"""
+FILE: benchmarks/generate_items.py
+------------------
+Generates synthetic eBay json files (items-0.json, items-1.json, ...) in the
+shape parser.parseJson expects, for benchmarking without the real data set.
+Output is deterministic for a given seed.
+
+The knobs cover the cases the parser has to handle: the number of bids per
+item, items without a Buy_Price, bidders without a Location or Country,
+null Descriptions and double quotes in names and locations.
+
+Usage: python benchmarks/generate_items.py [options] <output directory>
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+
+MONTH_NAMES = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+CATEGORIES = ['Collectibles', 'Books', 'Toys & Hobbies', 'Clothing & Accessories', 'Jewelry',
+              'Computers', 'Sports', 'Pottery & Glass', 'Coins', 'Stamps', 'Music', 'Antiques']
+WORDS = ['vintage', 'rare', 'new', 'signed', 'mint', 'lot', 'original', 'antique', 'collector',
+         'edition', 'set', 'boxed', 'limited', 'classic', 'large', 'small']
+LOCATIONS = ['Palo Alto, CA', 'New York, NY', 'Chicago', 'Seattle, WA', 'London', 'Austin, TX']
+COUNTRIES = ['USA', 'United Kingdom', 'Canada', 'Germany']
+
+# Defaults roughly follow the proportions of the original data set
+DEFAULTS = {
+    'items': 5000,
+    'files': 1,
+    'bids': 2.0,
+    'users': 0,
+    'buyPriceRate': 0.1,
+    'locationRate': 0.9,
+    'countryRate': 0.9,
+    'nullDescriptionRate': 0.05,
+    'quoteRate': 0.05,
+    'descriptionWords': 60,
+    'seed': 0,
+}
+
+# Formats a day number and a second within that day as Mon-DD-YY HH:MM:SS,
+# counting days from Jan-01-01. Months are treated as 28 days long so that
+# every generated date is valid.
+def formatDttm(day, second):
+    return '%s-%02d-%02d %02d:%02d:%02d' % (MONTH_NAMES[(day // 28) % 12], day % 28 + 1, 1 + day // 336,
+                                            second // 3600, second // 60 % 60, second % 60)
+
+def formatDollar(cents):
+    return '${:,}.{:02d}'.format(cents // 100, cents % 100)
+
+def text(rng, words, quoteRate):
+    value = ' '.join(rng.choice(WORDS) for i in range(words))
+    if rng.random() < quoteRate:
+        value = '"%s" %s' % (rng.choice(WORDS), value)
+    return value
+
+def user(rng, options):
+    return 'user%d' % rng.randrange(options['users'] or max(options['items'], 1))
+
+# Builds one item dictionary. Bid times and amounts increase strictly so that
+# the rows satisfy the Bids constraints in create.sql.
+def generateItem(rng, itemID, options):
+    numBids = int(rng.expovariate(1.0 / options['bids'])) if options['bids'] > 0 else 0
+    startDay = rng.randrange(0, 300)
+    start = rng.randrange(0, 86400 - 3600)
+    #bids are one second apart on the start day, so at most as many as there are seconds left in it
+    numBids = min(numBids, 86399 - start)
+    firstBid = rng.randrange(1, 10000) * 10
+    item = {
+        'ItemID': str(itemID),
+        'Name': text(rng, rng.randint(2, 6), options['quoteRate']),
+        'Category': rng.sample(CATEGORIES, rng.randint(1, 4)),
+        'First_Bid': formatDollar(firstBid),
+        'Number_of_Bids': str(numBids),
+        'Location': rng.choice(LOCATIONS) + (' "downtown"' if rng.random() < options['quoteRate'] else ''),
+        'Country': rng.choice(COUNTRIES),
+        'Started': formatDttm(startDay, start),
+        'Ends': formatDttm(startDay + rng.randint(1, 10), start),
+        'Seller': {'UserID': user(rng, options), 'Rating': str(rng.randrange(0, 5000))},
+        'Description': None,
+    }
+    if rng.random() >= options['nullDescriptionRate']:
+        item['Description'] = text(rng, options['descriptionWords'], options['quoteRate'])
+    bids = []
+    amount = firstBid
+    second = start
+    for i in range(numBids):
+        amount += rng.randrange(1, 500) * 5
+        second += 1
+        bidder = {'UserID': user(rng, options), 'Rating': str(rng.randrange(0, 5000))}
+        if rng.random() < options['locationRate']:
+            bidder['Location'] = rng.choice(LOCATIONS)
+        if rng.random() < options['countryRate']:
+            bidder['Country'] = rng.choice(COUNTRIES)
+        bids.append({'Bid': {'Bidder': bidder, 'Time': formatDttm(startDay, second), 'Amount': formatDollar(amount)}})
+    item['Currently'] = formatDollar(amount)
+    item['Bids'] = bids or None
+    if rng.random() < options['buyPriceRate']:
+        item['Buy_Price'] = formatDollar(amount + rng.randrange(1, 1000) * 100)
+    return item
+
+# Writes items firstID .. firstID + count - 1 to json_file one at a time, so
+# files of any size can be generated in constant memory
+def writeItemsFile(json_file, firstID, count, rng, options):
+    with open(json_file, 'w') as f:
+        f.write('{"Items": [')
+        for i in range(count):
+            if i > 0:
+                f.write(', ')
+            json.dump(generateItem(rng, firstID + i, options), f)
+        f.write(']}')
+
+# Writes options['items'] items spread over options['files'] files in out_dir
+# and returns the list of file names
+def generate(out_dir, **overrides):
+    options = dict(DEFAULTS)
+    options.update(overrides)
+    rng = random.Random(options['seed'])
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+    json_files = []
+    perFile = -(-options['items'] // options['files'])
+    for i in range(options['files']):
+        firstID = 1000000000 + i * perFile
+        count = max(0, min(perFile, options['items'] - i * perFile))
+        json_file = os.path.join(out_dir, 'items-%d.json' % i)
+        writeItemsFile(json_file, firstID, count, rng, options)
+        json_files.append(json_file)
+    return json_files
+
+def main(argv):
+    argParser = argparse.ArgumentParser(description = 'Generate synthetic eBay json files.')
+    argParser.add_argument('out_dir', help = 'directory to write items-*.json into')
+    argParser.add_argument('--items', type = int, default = DEFAULTS['items'], help = 'total number of items')
+    argParser.add_argument('--files', type = int, default = DEFAULTS['files'], help = 'number of files')
+    argParser.add_argument('--bids', type = float, default = DEFAULTS['bids'], help = 'mean number of bids per item')
+    argParser.add_argument('--users', type = int, default = DEFAULTS['users'], help = 'size of the user pool (default: number of items)')
+    argParser.add_argument('--buy-price-rate', dest = 'buyPriceRate', type = float, default = DEFAULTS['buyPriceRate'],
+                           help = 'fraction of items with a Buy_Price')
+    argParser.add_argument('--location-rate', dest = 'locationRate', type = float, default = DEFAULTS['locationRate'],
+                           help = 'fraction of bidders with a Location')
+    argParser.add_argument('--country-rate', dest = 'countryRate', type = float, default = DEFAULTS['countryRate'],
+                           help = 'fraction of bidders with a Country')
+    argParser.add_argument('--null-description-rate', dest = 'nullDescriptionRate', type = float,
+                           default = DEFAULTS['nullDescriptionRate'], help = 'fraction of items with a null Description')
+    argParser.add_argument('--quote-rate', dest = 'quoteRate', type = float, default = DEFAULTS['quoteRate'],
+                           help = 'fraction of names and locations containing double quotes')
+    argParser.add_argument('--description-words', dest = 'descriptionWords', type = int,
+                           default = DEFAULTS['descriptionWords'], help = 'words per description')
+    argParser.add_argument('--seed', type = int, default = DEFAULTS['seed'], help = 'random seed')
+    args = vars(argParser.parse_args(argv[1:]))
+    for json_file in generate(args.pop('out_dir'), **args):
+        print(json_file)
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,110 @@
+"""
+FILE: benchmarks/ingest.py
+------------------
+Benchmark harness for parser.py and loader.py. For each scale it generates
+synthetic json files with generate_items.py and measures three stages:
+
+  parse   parser.parseJsonRows over every file
+  dedupe  parsing plus the loader's per-file and cross-file key dedupe
+  load    loader.loadDatabase into a fresh database
+
+and reports items/sec, MB/sec of json input and peak RSS. Every stage runs in
+a fresh process so that peak RSS is not inherited from an earlier stage.
+
+Usage: python benchmarks/ingest.py [--scales 1000,10000,100000] [--files N]
+                                   [--workers N] [--stream] [--compact]
+"""
+
+import argparse
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import loader
+import parser
+from generate_items import generate
+
+DEFAULT_SCALES = '1000,10000,100000'
+STAGES = ('parse', 'dedupe', 'load')
+
+def parseStage(json_files, options):
+    rows = parser.streamJsonRows if options.stream else parser.parseJsonRows
+    for json_file in json_files:
+        for parsed in rows(json_file, compact = options.compact):
+            pass
+
+def dedupeStage(json_files, options):
+    seen = tuple(set() for table in loader.TABLES)
+    for shard in loader.parseShards(json_files, options.workers, options.compact):
+        for keys, rows, table in zip(seen, shard, loader.TABLES):
+            for row in rows:
+                keys.add(row[:table[2]])
+
+def loadStage(json_files, options):
+    db_file = os.path.join(tempfile.mkdtemp(), 'AuctionBase.db')
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        loader.loadDatabase(json_files, db_file, workers = options.workers,
+                            stream = options.stream, compact = options.compact)
+    finally:
+        sys.stdout = stdout
+        shutil.rmtree(os.path.dirname(db_file))
+
+STAGE_FUNCTIONS = {'parse': parseStage, 'dedupe': dedupeStage, 'load': loadStage}
+
+# Runs one stage in the current process and returns (seconds, peak RSS in KB).
+# Worker processes count towards the peak through RUSAGE_CHILDREN.
+def measure(stage, json_files, options):
+    start = time.time()
+    STAGE_FUNCTIONS[stage](json_files, options)
+    seconds = time.time() - start
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return seconds, peak
+
+def measureInChild(stage, json_files, options):
+    command = [sys.executable, os.path.abspath(__file__), '--child', stage, '--workers', str(options.workers)]
+    if options.stream:
+        command.append('--stream')
+    if options.compact:
+        command.append('--compact')
+    output = subprocess.check_output(command + ['--'] + json_files)
+    seconds, peak = output.split()
+    return float(seconds), int(peak)
+
+def main(argv):
+    argParser = argparse.ArgumentParser(description = 'Benchmark parsing and loading of eBay json files.')
+    argParser.add_argument('--scales', default = DEFAULT_SCALES, help = 'comma separated item counts')
+    argParser.add_argument('--files', type = int, default = 4, help = 'number of json files per scale')
+    argParser.add_argument('--workers', type = int, default = 1, help = 'parser processes for dedupe and load')
+    argParser.add_argument('--stream', action = 'store_true', help = 'use the streaming parser')
+    argParser.add_argument('--compact', action = 'store_true', help = 'use the compact schema')
+    argParser.add_argument('--child', choices = STAGES, help = argparse.SUPPRESS)
+    argParser.add_argument('json_files', nargs = '*', help = argparse.SUPPRESS)
+    options = argParser.parse_args(argv[1:])
+    if options.child:
+        print('%f %d' % measure(options.child, options.json_files, options))
+        return
+
+    print('%10s %8s %8s %12s %10s %10s' % ('items', 'MB', 'stage', 'items/sec', 'MB/sec', 'peak MB'))
+    for scale in [int(n) for n in options.scales.split(',')]:
+        data_dir = tempfile.mkdtemp()
+        try:
+            json_files = generate(data_dir, items = scale, files = options.files)
+            size = sum(os.path.getsize(f) for f in json_files) / 1048576.0
+            for stage in STAGES:
+                seconds, peak = measureInChild(stage, json_files, options)
+                print('%10d %8.1f %8s %12.0f %10.2f %10.1f' % (scale, size, stage, scale / seconds,
+                                                                 size / seconds, peak / 1024.0))
+        finally:
+            shutil.rmtree(data_dir)
+
+if __name__ == '__main__':
+    main(sys.argv)
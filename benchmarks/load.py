@@ -0,0 +1,263 @@
+"""
+FILE: benchmarks/load.py
+------------------
+Load test for the production server (web.py/serve.py). Builds a database from
+generated json files, with the clock set to the middle of the auctions as in
+bids.py, starts serve.py on it on a local port and drives a mix of requests
+at increasing concurrency:
+
+  search  POST /search by category and status, by a word of the description
+          or by a price range
+  items   GET /items for a random item
+  bid     POST /add_bid on a random open auction, with amounts that keep
+          rising so that bids are accepted as well as rejected
+
+Every client sends one request at a time, each on a new connection, for
+--duration seconds per concurrency level. The clients are threads spread over
+--client-processes processes so that the client side is not held back by the
+interpreter lock. For every level the harness reports throughput and the p50
+and p99 latency of all requests and of each kind. Errors count responses
+other than 200, including the 503s of a full server queue, and failed
+connections.
+
+Usage: python benchmarks/load.py [--items N] [--concurrency 1,4,16,64]
+                                 [--duration SECONDS] [--mix search=5,items=4,bid=1]
+                                 [--threads N] [--processes N] [--queue N]
+                                 [--client-processes N]
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+try:
+    import http.client as httplib
+    from urllib.parse import urlencode
+except ImportError:
+    import httplib
+    from urllib import urlencode
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+import loader
+from bids import startMidway
+from generate_items import generate
+
+SERVER = os.path.join(ROOT, 'web.py', 'serve.py')
+KINDS = ('search', 'items', 'bid')
+DEFAULT_CONCURRENCY = '1,4,16,64'
+DEFAULT_MIX = 'search=5,items=4,bid=1'
+STATUSES = ('open', 'close', 'notStarted', 'all')
+
+# Reads the values requests are made with from the database: item ids, open
+# auctions without a buy price with their current bid, bidders, categories
+# and words from item names
+def readTargets(db_file):
+    conn = loader.connect(db_file)
+    compact = conn.execute('PRAGMA user_version').fetchone()[0] == 1
+    scale = 100.0 if compact else 1.0
+    targets = {
+        'items': [row[0] for row in conn.execute('SELECT ItemID FROM Items')],
+        'open': [[row[0], row[1], row[2] / scale] for row in conn.execute(
+            "SELECT Items.ItemID, Items.Seller_UserID, Items.Currently FROM Items "
+            "JOIN ItemStatus ON ItemStatus.ItemID = Items.ItemID "
+            "WHERE ItemStatus.Status = 'open' AND Items.Buy_Price IS NULL")],
+        'users': [row[0] for row in conn.execute('SELECT UserID FROM Users LIMIT 100')],
+        'categories': [row[0] for row in conn.execute('SELECT DISTINCT Category FROM Categories')],
+        'words': sorted(set(word for row in conn.execute('SELECT Name FROM Items LIMIT 1000')
+                            for word in row[0].split() if word.isalpha() and len(word) > 3)),
+    }
+    conn.close()
+    return targets
+
+def searchRequest(targets, rnd):
+    params = dict((name, '') for name in ('userID', 'itemID', 'category', 'description', 'minPrice', 'maxPrice'))
+    params['status'] = rnd.choice(STATUSES)
+    choice = rnd.randrange(3)
+    if choice == 0:
+        params['category'] = rnd.choice(targets['categories'])
+    elif choice == 1:
+        params['description'] = rnd.choice(targets['words'])
+    else:
+        low = rnd.randrange(1, 200)
+        params['minPrice'] = str(low)
+        params['maxPrice'] = str(low + rnd.randrange(1, 50))
+    return 'POST', '/search', params
+
+def itemsRequest(targets, rnd):
+    return 'GET', '/items?' + urlencode({'id': rnd.choice(targets['items'])}), None
+
+def bidRequest(targets, rnd):
+    item = rnd.choice(targets['open'])
+    bidder = rnd.choice([user for user in targets['users'][:2] if user != item[1]])
+    #the amount grows with the time since the client started, so later bids beat earlier ones
+    amount = item[2] + (time.time() - targets['started']) * 10 + rnd.random()
+    return 'POST', '/add_bid', {'userID': bidder, 'itemID': item[0], 'price': '%.2f' % amount}
+
+REQUESTS = {'search': searchRequest, 'items': itemsRequest, 'bid': bidRequest}
+
+# Sends one request and returns its status, or 0 if the connection failed
+def send(port, method, path, params):
+    conn = httplib.HTTPConnection('127.0.0.1', port, timeout = 60)
+    try:
+        if params is None:
+            conn.request(method, path)
+        else:
+            conn.request(method, path, urlencode(params), {'Content-Type': 'application/x-www-form-urlencoded'})
+        response = conn.getresponse()
+        response.read()
+        return response.status
+    except (socket.error, httplib.HTTPException):
+        return 0
+    finally:
+        conn.close()
+
+# Runs the given number of client threads for duration seconds and returns
+# (kind, seconds, status) for every request they sent
+def runClients(port, threads, duration, mix, targets):
+    kinds = [kind for kind in KINDS for i in range(mix.get(kind, 0))]
+    targets['started'] = time.time()
+    deadline = targets['started'] + duration
+    results = []
+
+    def client(seed):
+        rnd = random.Random(seed)
+        mine = []
+        while time.time() < deadline:
+            kind = rnd.choice(kinds)
+            method, path, params = REQUESTS[kind](targets, rnd)
+            start = time.time()
+            status = send(port, method, path, params)
+            mine.append((kind, time.time() - start, status))
+        results.extend(mine)
+
+    workers = [threading.Thread(target = client, args = (random.random(),)) for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return results
+
+def runClientsInChildren(port, concurrency, options, targets_file):
+    processes = min(options.clientProcesses, concurrency)
+    children = []
+    for i in range(processes):
+        threads = concurrency // processes + (1 if i < concurrency % processes else 0)
+        children.append(subprocess.Popen([sys.executable, os.path.abspath(__file__), '--child', str(port),
+                                          '--client-threads', str(threads), '--duration', str(options.duration),
+                                          '--mix', options.mix, '--targets', targets_file],
+                                         stdout = subprocess.PIPE))
+    results = []
+    for child in children:
+        output = child.communicate()[0]
+        results.extend(tuple(result) for result in json.loads(output.decode('utf-8')))
+    return results
+
+def parseMix(mix):
+    weights = {}
+    for part in mix.split(','):
+        kind, weight = part.split('=')
+        if kind not in KINDS:
+            raise ValueError('unknown request kind %s' % kind)
+        weights[kind] = int(weight)
+    return weights
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def report(concurrency, results, duration):
+    for kind in ('all',) + KINDS:
+        chosen = [result for result in results if kind == 'all' or result[0] == kind]
+        if not chosen:
+            continue
+        latencies = sorted(result[1] for result in chosen)
+        errors = len([result for result in chosen if result[2] != 200])
+        print('%6d %8s %10d %10.1f %9.1f %9.1f %8d' % (concurrency, kind, len(chosen), len(chosen) / float(duration),
+                                                    percentile(latencies, 0.5) * 1000,
+                                                    percentile(latencies, 0.99) * 1000, errors))
+
+def waitForServer(port, server, timeout = 30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if server.poll() is not None:
+            raise Exception('serve.py exited with status %d' % server.returncode)
+        try:
+            socket.create_connection(('127.0.0.1', port), 1).close()
+            return
+        except socket.error:
+            time.sleep(0.1)
+    raise Exception('serve.py did not start listening on port %d' % port)
+
+def freePort():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+def main(argv):
+    argParser = argparse.ArgumentParser(description = 'Load test serve.py with a mix of search, item and bid requests.')
+    argParser.add_argument('--items', type = int, default = 20000, help = 'number of generated items')
+    argParser.add_argument('--compact', action = 'store_true', help = 'use the compact schema')
+    argParser.add_argument('--concurrency', default = DEFAULT_CONCURRENCY, help = 'comma separated client counts')
+    argParser.add_argument('--duration', type = float, default = 10, help = 'seconds per concurrency level')
+    argParser.add_argument('--mix', default = DEFAULT_MIX, help = 'relative weights of the request kinds')
+    argParser.add_argument('--threads', type = int, default = 16, help = 'server worker threads per process')
+    argParser.add_argument('--processes', type = int, default = 1, help = 'server processes')
+    argParser.add_argument('--queue', type = int, default = 64, help = 'server queue of accepted connections')
+    argParser.add_argument('--client-processes', dest = 'clientProcesses', type = int, default = 4,
+                           help = 'processes the clients are spread over')
+    argParser.add_argument('--child', type = int, help = argparse.SUPPRESS)
+    argParser.add_argument('--client-threads', dest = 'clientThreads', type = int, help = argparse.SUPPRESS)
+    argParser.add_argument('--targets', help = argparse.SUPPRESS)
+    options = argParser.parse_args(argv[1:])
+    mix = parseMix(options.mix)
+    if options.child:
+        with open(options.targets) as targets_file:
+            targets = json.load(targets_file)
+        print(json.dumps(runClients(options.child, options.clientThreads, options.duration, mix, targets)))
+        return
+
+    work_dir = tempfile.mkdtemp()
+    server = None
+    try:
+        json_files = generate(os.path.join(work_dir, 'json'), items = options.items)
+        db_file = os.path.join(work_dir, 'AuctionBase.db')
+        stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+        try:
+            loader.loadDatabase(json_files, db_file, compact = options.compact)
+        finally:
+            sys.stdout = stdout
+        startMidway(db_file)
+        targets_file = os.path.join(work_dir, 'targets.json')
+        with open(targets_file, 'w') as out:
+            json.dump(readTargets(db_file), out)
+
+        port = freePort()
+        server = subprocess.Popen([sys.executable, SERVER, '--host', '127.0.0.1', '--port', str(port),
+                                   '--threads', str(options.threads), '--processes', str(options.processes),
+                                   '--queue', str(options.queue)],
+                                  cwd = work_dir, stdout = open(os.devnull, 'w'))
+        waitForServer(port, server)
+        print('%d server processes of %d threads, queue %d' % (options.processes, options.threads, options.queue))
+        print('%6s %8s %10s %10s %9s %9s %8s' % ('conc', 'kind', 'requests', 'req/sec', 'p50 ms', 'p99 ms', 'errors'))
+        for concurrency in [int(n) for n in options.concurrency.split(',')]:
+            report(concurrency, runClientsInChildren(port, concurrency, options, targets_file), options.duration)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        shutil.rmtree(work_dir)
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,53 @@
+"""
+FILE: benchmarks/stream_memory.py
+------------------
+Memory benchmark for streaming json ingestion. Generates json files of
+growing size with generate_items.py and reports the peak RSS of parsing each
+one with parser.parseJsonRows (whole file in memory) and with
+parser.streamJsonRows (one item at a time).
+Every measurement runs in a fresh process so that peaks do not carry over.
+
+Usage: python benchmarks/stream_memory.py [item counts...]
+"""
+
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import parser
+from generate_items import generate
+
+DEFAULT_SIZES = [10000, 40000, 160000]
+MODES = {'load': parser.parseJsonRows, 'stream': parser.streamJsonRows}
+
+# Parses json_file in the current process and returns the peak RSS in KB
+def measure(mode, json_file):
+    for rows in MODES[mode](json_file):
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def measureInChild(mode, json_file):
+    output = subprocess.check_output([sys.executable, os.path.abspath(__file__), '--child', mode, json_file])
+    return int(output)
+
+def main(argv):
+    if len(argv) == 4 and argv[1] == '--child':
+        print(measure(argv[2], argv[3]))
+        return
+    sizes = [int(n) for n in argv[1:]] or DEFAULT_SIZES
+    tmp_dir = tempfile.mkdtemp()
+    print('%10s %10s %14s %14s' % ('items', 'file MB', 'load RSS MB', 'stream RSS MB'))
+    for n in sizes:
+        json_file = generate(tmp_dir, items = n)[0]
+        size = os.path.getsize(json_file) / 1048576.0
+        peaks = [measureInChild(mode, json_file) / 1024.0 for mode in ('load', 'stream')]
+        print('%10d %10.1f %14.1f %14.1f' % (n, size, peaks[0], peaks[1]))
+        os.remove(json_file)
+    os.rmdir(tmp_dir)
+
+if __name__ == '__main__':
+    main(sys.argv)
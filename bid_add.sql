@@ -0,0 +1,39 @@
+-- description: Constraints 11, 13, 14 and 15 on new bids, replacing the
+-- separate triggers 2 to 8. A bid is checked against its item and the current
+-- time with one lookup, failing with the same TriggerN_Failed error as the
+-- trigger it replaces, and Number_of_Bids and Currently are updated with one
+-- UPDATE of the item instead of two.
+
+PRAGMA foreign_keys = ON;
+
+drop trigger if exists trigger2;
+drop trigger if exists trigger3;
+drop trigger if exists trigger4;
+drop trigger if exists trigger5;
+drop trigger if exists trigger6;
+drop trigger if exists trigger7;
+drop trigger if exists trigger8;
+drop trigger if exists bid_check;
+drop trigger if exists bid_apply;
+
+create trigger bid_check
+	before insert on Bids
+	for each row
+	begin
+		SELECT CASE
+			WHEN NEW.Time != c.Time THEN raise(rollback, 'Trigger2_Failed')
+			WHEN i.Number_of_Bids > 0 AND NEW.Amount <= i.Currently
+			  OR i.Number_of_Bids == 0 AND NEW.Amount < i.Currently THEN raise(rollback, 'Trigger3_Failed')
+			WHEN NEW.Time < i.Started THEN raise(rollback, 'Trigger5_Failed')
+			WHEN NEW.Time > i.Ends THEN raise(rollback, 'Trigger6_Failed')
+			WHEN NEW.UserID = i.Seller_UserID THEN raise(rollback, 'Trigger7_Failed')
+		END
+		FROM CurrentTime c LEFT JOIN Items i ON i.ItemID = NEW.ItemID;
+	end;
+
+create trigger bid_apply
+	after insert on Bids
+	for each row
+	begin
+		UPDATE Items SET Number_of_Bids = Number_of_Bids + 1, Currently = NEW.Amount WHERE ItemID = NEW.ItemID;
+	end;
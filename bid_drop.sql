@@ -0,0 +1,4 @@
+PRAGMA foreign_keys = ON;
+
+drop trigger bid_check;
+drop trigger bid_apply;
@@ -1,8 +1,12 @@
+-- Text schema (user_version 0), see create_compact.sql for the compact one
+PRAGMA user_version = 0;
+
 DROP TABLE IF EXISTS Items;
 DROP TABLE IF EXISTS Categories;
 DROP TABLE IF EXISTS Bids;
 DROP TABLE IF EXISTS Users;
 DROP TABLE IF EXISTS CurrentTime;
+DROP TABLE IF EXISTS IngestedFiles;
 
 CREATE TABLE Items (
    ItemID INTEGER,
@@ -9,3 +9,9 @@ sqlite3 AuctionBase.db < trigger5_add.sql
 sqlite3 AuctionBase.db < trigger6_add.sql
 sqlite3 AuctionBase.db < trigger7_add.sql
 sqlite3 AuctionBase.db < trigger8_add.sql
+sqlite3 AuctionBase.db < bid_add.sql
+sqlite3 AuctionBase.db < indexes.sql
+sqlite3 AuctionBase.db < search_add.sql
+sqlite3 AuctionBase.db < status_add.sql
+sqlite3 AuctionBase.db < settlement_add.sql
+sqlite3 AuctionBase.db < facet_add.sql
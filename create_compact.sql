@@ -0,0 +1,62 @@
+-- Compact version of create.sql: times are stored as integer seconds since
+-- the epoch (UTC) and amounts as integer cents. sqlitedb.py recognizes this
+-- schema by its user_version and formats values only when they are displayed.
+
+PRAGMA user_version = 1;
+
+DROP TABLE IF EXISTS Items;
+DROP TABLE IF EXISTS Categories;
+DROP TABLE IF EXISTS Bids;
+DROP TABLE IF EXISTS Users;
+DROP TABLE IF EXISTS CurrentTime;
+DROP TABLE IF EXISTS IngestedFiles;
+
+CREATE TABLE Items (
+   ItemID INTEGER,
+   Name TEXT,
+   Currently INTEGER,
+   First_Bid INTEGER,
+   Buy_Price INTEGER,
+   Number_of_Bids INTEGER,
+   Started INTEGER,
+   Ends INTEGER,
+   Seller_UserID TEXT,
+   Description TEXT,
+   PRIMARY KEY(ItemID),
+   FOREIGN KEY(Seller_UserID) REFERENCES Users(UserID) DEFERRABLE INITIALLY DEFERRED,
+   CHECK (Ends > Started)
+);
+
+CREATE TABLE Categories (
+   ItemID INTEGER,
+   Category TEXT,
+   PRIMARY KEY(ItemID, Category),
+   FOREIGN KEY(ItemID) REFERENCES Items(ItemID) DEFERRABLE INITIALLY DEFERRED
+);
+
+CREATE TABLE Bids (
+   ItemID INTEGER,
+   UserID TEXT,
+   Amount INTEGER,
+   Time INTEGER,
+   PRIMARY KEY(ItemID, UserID, Amount),
+   UNIQUE(ItemID, Time),
+   FOREIGN KEY(ItemID) REFERENCES Items(ItemID) DEFERRABLE INITIALLY DEFERRED,
+   FOREIGN KEY(UserID) REFERENCES Users(UserID) DEFERRABLE INITIALLY DEFERRED
+);
+
+CREATE TABLE Users (
+   UserID TEXT,
+   Rating INTEGER,
+   Location TEXT,
+   Country TEXT,
+   PRIMARY KEY(UserID)
+);
+
+CREATE TABLE CurrentTime (
+   Time INTEGER
+);
+
+SELECT Time FROM CurrentTime;
+
+INSERT into CurrentTime values (1008806401);
\ No newline at end of file
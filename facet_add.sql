@@ -0,0 +1,104 @@
+-- description: Category facets: every category name is given an integer id
+-- in CategoryNames, and CategoryFacets holds the number of items in each
+-- category with each status, so that sqlitedb.getCategoryFacets reads one row
+-- per category instead of grouping Categories and ItemStatus on every search.
+-- The counts follow ItemStatus, whose rows change when items are added or
+-- bid on and when the clock moves. Requires ItemStatus (status_add.sql).
+
+drop trigger if exists facet_name_insert;
+drop trigger if exists facet_category_insert;
+drop trigger if exists facet_category_delete;
+drop trigger if exists facet_status_insert;
+drop trigger if exists facet_status_delete;
+drop trigger if exists facet_status_update;
+drop table if exists CategoryFacets;
+drop table if exists CategoryNames;
+
+create table CategoryNames (
+	CategoryID INTEGER PRIMARY KEY,
+	Category TEXT UNIQUE
+);
+
+-- one row for each category and status, including the empty ones, so that
+-- the triggers only ever update counts
+create table CategoryFacets (
+	CategoryID INTEGER,
+	Status TEXT,
+	Items INTEGER,
+	PRIMARY KEY(CategoryID, Status)
+) without rowid;
+
+insert into CategoryNames(Category)
+	select distinct Category from Categories order by Category;
+
+insert into CategoryFacets
+	select n.CategoryID, s.Status, IFNULL(g.Items, 0)
+	from CategoryNames n
+		cross join (SELECT 'notStarted' AS Status UNION ALL SELECT 'open' UNION ALL SELECT 'close') s
+		left join (SELECT c.Category, i.Status, COUNT(*) AS Items
+		           FROM Categories c JOIN ItemStatus i ON i.ItemID = c.ItemID
+		           GROUP BY c.Category, i.Status) g
+			on g.Category = n.Category and g.Status = s.Status;
+
+create trigger facet_name_insert
+	after insert on CategoryNames
+	for each row
+	begin
+		INSERT INTO CategoryFacets VALUES
+			(NEW.CategoryID, 'notStarted', 0), (NEW.CategoryID, 'open', 0), (NEW.CategoryID, 'close', 0);
+	end;
+
+-- the loader may add an item's categories before the item itself, in which
+-- case the item has no status yet and is counted by facet_status_insert
+create trigger facet_category_insert
+	after insert on Categories
+	for each row
+	begin
+		INSERT INTO CategoryNames(Category)
+			SELECT NEW.Category WHERE NOT EXISTS (SELECT 1 FROM CategoryNames WHERE Category = NEW.Category);
+		UPDATE CategoryFacets SET Items = Items + 1
+			WHERE CategoryID = (SELECT CategoryID FROM CategoryNames WHERE Category = NEW.Category)
+			  AND Status = (SELECT Status FROM ItemStatus WHERE ItemID = NEW.ItemID);
+	end;
+
+create trigger facet_category_delete
+	after delete on Categories
+	for each row
+	begin
+		UPDATE CategoryFacets SET Items = Items - 1
+			WHERE CategoryID = (SELECT CategoryID FROM CategoryNames WHERE Category = OLD.Category)
+			  AND Status = (SELECT Status FROM ItemStatus WHERE ItemID = OLD.ItemID);
+	end;
+
+create trigger facet_status_insert
+	after insert on ItemStatus
+	for each row
+	begin
+		UPDATE CategoryFacets SET Items = Items + 1
+			WHERE Status = NEW.Status
+			  AND CategoryID IN (SELECT n.CategoryID FROM Categories c JOIN CategoryNames n ON n.Category = c.Category
+			                     WHERE c.ItemID = NEW.ItemID);
+	end;
+
+create trigger facet_status_delete
+	after delete on ItemStatus
+	for each row
+	begin
+		UPDATE CategoryFacets SET Items = Items - 1
+			WHERE Status = OLD.Status
+			  AND CategoryID IN (SELECT n.CategoryID FROM Categories c JOIN CategoryNames n ON n.Category = c.Category
+			                     WHERE c.ItemID = OLD.ItemID);
+	end;
+
+-- status_time updates the status of the auctions that start or end when the
+-- clock moves
+create trigger facet_status_update
+	after update of Status on ItemStatus
+	for each row
+	when OLD.Status IS NOT NEW.Status
+	begin
+		UPDATE CategoryFacets SET Items = Items + (CASE WHEN Status = NEW.Status THEN 1 ELSE -1 END)
+			WHERE Status IN (OLD.Status, NEW.Status)
+			  AND CategoryID IN (SELECT n.CategoryID FROM Categories c JOIN CategoryNames n ON n.Category = c.Category
+			                     WHERE c.ItemID = NEW.ItemID);
+	end;
@@ -0,0 +1,8 @@
+drop trigger facet_name_insert;
+drop trigger facet_category_insert;
+drop trigger facet_category_delete;
+drop trigger facet_status_insert;
+drop trigger facet_status_delete;
+drop trigger facet_status_update;
+drop table CategoryFacets;
+drop table CategoryNames;
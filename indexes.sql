@@ -0,0 +1,9 @@
+-- description: Secondary indexes used by sqlitedb.searchAuction
+
+create index if not exists Categories_Category on Categories(Category);
+create index if not exists Items_Seller_UserID on Items(Seller_UserID);
+create index if not exists Items_Ends on Items(Ends);
+create index if not exists Items_Started on Items(Started);
+
+-- the price shown in search results, used by minPrice / maxPrice
+create index if not exists Items_Price on Items(IFNULL(Currently, First_Bid));
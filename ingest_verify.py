@@ -0,0 +1,88 @@
+"""
+FILE: ingest_verify.py
+------------------
+Checks that an incremental load builds the same database as a full load.
+Generates --files json files with benchmarks/generate_items.py, loads all of
+them with loader.loadDatabase, then loads all but the last and adds the last
+one with loader.ingestDatabase, and compares the tables the triggers keep:
+Settlements, ItemStatus and CategoryFacets, along with Items and Bids. Both
+the text and the compact schema are checked. Exits with status 1 if any table
+differs.
+
+Usage: python ingest_verify.py [--items N] [--files N]
+"""
+
+import argparse
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+import loader
+from generate_items import generate
+
+COMPARED_TABLES = ('Items', 'Bids', 'ItemStatus', 'Settlements', 'CategoryFacets')
+
+# Category ids depend on the order categories were first seen, so facets are
+# compared by category name
+QUERIES = {
+    'CategoryFacets': 'SELECT n.Category, f.Status, f.Items FROM CategoryFacets f '
+                      'JOIN CategoryNames n ON n.CategoryID = f.CategoryID',
+}
+
+def tableRows(db_file, table):
+    conn = sqlite3.connect(db_file)
+    try:
+        return sorted(conn.execute(QUERIES.get(table, 'SELECT * FROM %s' % table)))
+    finally:
+        conn.close()
+
+# Returns the tables that differ between a full and an incremental load of json_files
+def compareLoads(json_files, work_dir, compact):
+    full_file = os.path.join(work_dir, 'full.db')
+    incremental_file = os.path.join(work_dir, 'incremental.db')
+    for db_file in (full_file, incremental_file):
+        if os.path.exists(db_file):
+            os.remove(db_file)
+    loader.loadDatabase(json_files, full_file, compact = compact)
+    loader.loadDatabase(json_files[:-1], incremental_file, compact = compact)
+    loader.ingestDatabase(json_files[-1:], incremental_file)
+    return [table for table in COMPARED_TABLES
+            if tableRows(full_file, table) != tableRows(incremental_file, table)]
+
+def main(argv):
+    argParser = argparse.ArgumentParser(description = 'Check that incremental loads match full loads.')
+    argParser.add_argument('--items', type = int, default = 3000, help = 'number of generated items')
+    argParser.add_argument('--files', type = int, default = 3, help = 'number of json files (at least 2)')
+    options = argParser.parse_args(argv[1:])
+    if options.files < 2:
+        argParser.error('--files must be at least 2')
+
+    work_dir = tempfile.mkdtemp()
+    failed = False
+    try:
+        json_files = generate(os.path.join(work_dir, 'json'), items = options.items, files = options.files)
+        for compact in (False, True):
+            stdout = sys.stdout
+            sys.stdout = open(os.devnull, 'w')
+            try:
+                differing = compareLoads(json_files, work_dir, compact)
+            finally:
+                sys.stdout = stdout
+            schema = 'compact' if compact else 'text'
+            if differing:
+                failed = True
+                print('FAIL %-8s %s differ' % (schema, ', '.join(differing)))
+            else:
+                print('ok   %-8s %s match' % (schema, ', '.join(COMPARED_TABLES)))
+    finally:
+        shutil.rmtree(work_dir)
+    if failed:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main(sys.argv)
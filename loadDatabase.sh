@@ -0,0 +1 @@
+python loader.py ../ebay_data/items-*.json
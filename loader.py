@@ -0,0 +1,417 @@
+"""
+FILE: loader.py
+------------------
+Bulk loader for AuctionBase. Parses the eBay json files with parser.py and
+writes the rows straight into a SQLite database, replacing the
+items.dat / sort -u / .import pipeline of runParser.sh and createDatabase.sh.
+
+The database is built in a temporary file next to the target and renamed
+into place once it is complete, so the live AuctionBase.db is only replaced
+by a finished database. All rows are inserted inside one transaction with
+batched executemany calls; indexes and triggers are created after the
+data is in.
+
+With --workers N the json files are parsed by a pool of N processes. Each
+worker returns the rows of one file and the main process merges them in
+command line order, so the database is the same whatever the worker count.
+
+With --stream each file is read incrementally and rows are inserted as each
+item completes. Duplicates are then left to INSERT OR IGNORE instead of being
+tracked in memory, so memory use does not grow with the size of the input.
+
+With --incremental the json files are added to an existing database instead.
+Every loaded file is recorded in IngestedFiles with its path, size and hash;
+files that are already recorded unchanged are skipped, and each new or changed
+file is upserted in its own transaction. An interrupted run therefore resumes
+after the last committed file when started again.
+
+With --compact the database is built from create_compact.sql, storing times
+as epoch seconds and amounts as integer cents. Incremental loads detect the
+schema of the database they are adding to.
+
+Usage: python loader.py [--db AuctionBase.db] [--compact]
+                        [--workers N | --stream | --incremental] <path to json files>
+"""
+
+import argparse
+import functools
+import hashlib
+import multiprocessing
+import os
+import sqlite3
+import sys
+
+from parser import isJson, parseJsonRows, streamJsonRows
+
+SQL_DIR = os.path.dirname(os.path.abspath(__file__))
+DATABASE = 'AuctionBase.db'
+SCHEMA_FILE = os.path.join(SQL_DIR, 'create.sql')
+COMPACT_SCHEMA_FILE = os.path.join(SQL_DIR, 'create_compact.sql')
+COMPACT_SCHEMA_VERSION = 1
+# bid_add.sql replaces triggers 2 to 8 with two consolidated bid triggers, so
+# it has to run after them
+TRIGGER_FILES = ([os.path.join(SQL_DIR, 'trigger%d_add.sql' % i) for i in range(1, 9)] +
+                 [os.path.join(SQL_DIR, 'bid_add.sql')])
+INDEX_FILE = os.path.join(SQL_DIR, 'indexes.sql')
+SEARCH_FILE = os.path.join(SQL_DIR, 'search_add.sql')
+STATUS_FILE = os.path.join(SQL_DIR, 'status_add.sql')
+SETTLEMENT_FILE = os.path.join(SQL_DIR, 'settlement_add.sql')
+FACET_FILE = os.path.join(SQL_DIR, 'facet_add.sql')
+BATCH_SIZE = 10000
+
+# (table, number of columns, number of leading primary key columns)
+TABLES = (('Items', 10, 1), ('Categories', 2, 2), ('Bids', 4, 3), ('Users', 4, 1))
+TRIGGERS = ['trigger%d' % i for i in range(1, 9)] + ['bid_check', 'bid_apply']
+
+# Json files that have been loaded into the database, used to skip unchanged
+# files on incremental runs
+INGESTED_FILES_TABLE = """CREATE TABLE IF NOT EXISTS IngestedFiles (
+   Path TEXT,
+   Size INTEGER,
+   MTime REAL,
+   Hash TEXT,
+   PRIMARY KEY(Path)
+)"""
+
+# Conflict clauses used by incremental loads. Items take the values from the
+# newest file, except that the price and bid count never move backwards past
+# bids already placed on the site. Existing users get the new rating and keep
+# their location and country when the new file does not have them. Tables
+# without an entry keep their existing rows.
+UPSERTS = {
+    'Items': 'ON CONFLICT(ItemID) DO UPDATE SET Name = excluded.Name, '
+             'Currently = MAX(Currently, excluded.Currently), First_Bid = excluded.First_Bid, '
+             'Buy_Price = excluded.Buy_Price, '
+             'Number_of_Bids = MAX(Number_of_Bids, excluded.Number_of_Bids), '
+             'Started = excluded.Started, Ends = excluded.Ends, '
+             'Seller_UserID = excluded.Seller_UserID, Description = excluded.Description',
+    'Users': 'ON CONFLICT(UserID) DO UPDATE SET Rating = excluded.Rating, '
+             'Location = IFNULL(excluded.Location, Location), '
+             'Country = IFNULL(excluded.Country, Country)',
+}
+# Settles a closed item of an incremental load again once all of its file's
+# rows are in. The Items rows fire the settlement triggers (settlement_add.sql)
+# as they are written, which may be before the item's Bids, so the winner,
+# price and close time are recomputed as those triggers compute them.
+RESETTLE = """UPDATE Settlements SET
+   Winner_UserID = (SELECT b.UserID FROM Bids b WHERE b.ItemID = Settlements.ItemID ORDER BY b.Amount DESC LIMIT 1),
+   Price = (SELECT MAX(b.Amount) FROM Bids b WHERE b.ItemID = Settlements.ItemID),
+   Closed = (SELECT CASE WHEN (IFNULL(i.Currently, i.First_Bid) >= i.Buy_Price) IS 1
+                         THEN IFNULL((SELECT MAX(b.Time) FROM Bids b WHERE b.ItemID = i.ItemID), i.Started)
+                         ELSE i.Ends END
+             FROM Items i WHERE i.ItemID = Settlements.ItemID)
+   WHERE ItemID = ?"""
+HASH_CHUNK_SIZE = 1 << 20
+
+# Settings for building a throwaway database file as fast as possible. They
+# give up crash safety, which is fine because an interrupted load is never
+# renamed over the real database.
+BULK_LOAD_PRAGMAS = (
+    'PRAGMA journal_mode = OFF',
+    'PRAGMA synchronous = OFF',
+    'PRAGMA locking_mode = EXCLUSIVE',
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA cache_size = -262144',
+)
+
+# Buffers the rows of one table, drops rows whose primary key has already been
+# seen and writes the rest with executemany once BATCH_SIZE rows are pending.
+# The first row seen for a key wins. Without dedupe no keys are remembered and
+# duplicates are only dropped by INSERT OR IGNORE, with the same result. An
+# upsert clause replaces OR IGNORE so that rows already in the table are merged.
+class TableLoader(object):
+    def __init__(self, conn, table, columns, keyColumns, batchSize = BATCH_SIZE, dedupe = True, upsert = None):
+        self.conn = conn
+        self.table = table
+        values = ', '.join(['?'] * columns)
+        if upsert is None:
+            self.statement = 'INSERT OR IGNORE INTO %s VALUES (%s)' % (table, values)
+        else:
+            self.statement = 'INSERT INTO %s VALUES (%s) %s' % (table, values, upsert)
+        self.keyColumns = keyColumns
+        self.batchSize = batchSize
+        self.seen = set() if dedupe else None
+        self.pending = []
+        self.count = 0
+
+    def add(self, row):
+        if self.seen is not None:
+            key = row[0] if self.keyColumns == 1 else row[:self.keyColumns]
+            if key in self.seen:
+                return
+            self.seen.add(key)
+        self.pending.append(row)
+        if len(self.pending) >= self.batchSize:
+            self.flush()
+
+    def addAll(self, rows):
+        for row in rows:
+            self.add(row)
+
+    def flush(self):
+        if self.pending:
+            self.count += self.conn.executemany(self.statement, self.pending).rowcount
+            del self.pending[:]
+
+# Opens a connection in autocommit mode so that transactions are controlled
+# explicitly with BEGIN / COMMIT
+def connect(db_file):
+    return sqlite3.connect(db_file, isolation_level = None)
+
+def tuneForBulkLoad(conn):
+    for pragma in BULK_LOAD_PRAGMAS:
+        conn.execute(pragma)
+
+def runScript(conn, script_file):
+    with open(script_file, 'r') as f:
+        conn.executescript(f.read())
+
+# Yields the statements of a sql script one at a time. Unlike executescript,
+# executing them one by one does not commit the current transaction.
+def scriptStatements(script_file):
+    statement = ''
+    with open(script_file, 'r') as f:
+        for line in f:
+            statement += line
+            if sqlite3.complete_statement(statement):
+                yield statement
+                statement = ''
+
+# Creates one TableLoader per table, in the column order of create.sql
+def tableLoaders(conn, batchSize = BATCH_SIZE, dedupe = True):
+    return tuple(TableLoader(conn, table, columns, keyColumns, batchSize, dedupe)
+                 for table, columns, keyColumns in TABLES)
+
+# Writes parsed (item, categories, bids, users) tuples through the loaders
+def loadRows(loaders, parsedItems):
+    items, categories, bids, users = loaders
+    for itemRow, categoryRows, bidRows, userRows in parsedItems:
+        items.add(itemRow)
+        categories.addAll(categoryRows)
+        bids.addAll(bidRows)
+        users.addAll(userRows)
+
+# Parses one json file into a shard: four lists holding the file's Items,
+# Categories, Bids and Users rows. Rows repeating a key already seen in the
+# same file are dropped here so that less data goes back to the parent.
+def parseShard(json_file, compact = False):
+    shard = ([], [], [], [])
+    seen = (set(), set(), set(), set())
+    for itemRow, categoryRows, bidRows, userRows in parseJsonRows(json_file, compact):
+        for table, rows in enumerate(([itemRow], categoryRows, bidRows, userRows)):
+            for row in rows:
+                key = row[:TABLES[table][2]]
+                if key not in seen[table]:
+                    seen[table].add(key)
+                    shard[table].append(row)
+    return shard
+
+# Merges a shard into the loaders. Shards must be merged in input order: the
+# first row seen for a key wins, so a user appearing with different Rating or
+# Location keeps the values from the earliest file and item.
+def loadShard(loaders, shard):
+    for loader, rows in zip(loaders, shard):
+        loader.addAll(rows)
+
+# Yields the shard of each json file, in order. With more than one worker the
+# files are parsed in parallel while earlier shards are being inserted.
+def parseShards(json_files, workers = 1, compact = False):
+    if workers <= 1:
+        for json_file in json_files:
+            yield parseShard(json_file, compact)
+        return
+    pool = multiprocessing.Pool(workers)
+    try:
+        for shard in pool.imap(functools.partial(parseShard, compact = compact), json_files):
+            yield shard
+    finally:
+        pool.terminate()
+
+# Returns the (path, size, modification time) of a json file
+def fileSignature(json_file):
+    return os.path.abspath(json_file), os.path.getsize(json_file), os.path.getmtime(json_file)
+
+def fileHash(json_file):
+    digest = hashlib.sha1()
+    with open(json_file, 'rb') as f:
+        chunk = f.read(HASH_CHUNK_SIZE)
+        while chunk:
+            digest.update(chunk)
+            chunk = f.read(HASH_CHUNK_SIZE)
+    return digest.hexdigest()
+
+def recordFile(conn, json_file, digest = None):
+    conn.execute('INSERT OR REPLACE INTO IngestedFiles VALUES (?, ?, ?, ?)',
+                 fileSignature(json_file) + (digest or fileHash(json_file),))
+
+# Creates the indexes, the full-text index and the triggers once the data is
+# in and reports foreign key violations, which used to be checked by
+# constraints_verify.sql
+def finishLoad(conn):
+    runScript(conn, INDEX_FILE)
+    runScript(conn, SEARCH_FILE)
+    runScript(conn, STATUS_FILE)
+    runScript(conn, SETTLEMENT_FILE)
+    runScript(conn, FACET_FILE)
+    for script_file in TRIGGER_FILES:
+        runScript(conn, script_file)
+    for violation in conn.execute('PRAGMA foreign_key_check'):
+        sys.stderr.write('Foreign key violation: %s\n' % (violation,))
+
+# Builds a complete database from the given json files into db_file
+def loadDatabase(json_files, db_file = DATABASE, batchSize = BATCH_SIZE, workers = 1, stream = False,
+                 compact = False):
+    tmp_file = db_file + '.tmp'
+    if os.path.exists(tmp_file):
+        os.remove(tmp_file)
+    conn = connect(tmp_file)
+    try:
+        tuneForBulkLoad(conn)
+        runScript(conn, COMPACT_SCHEMA_FILE if compact else SCHEMA_FILE)
+        conn.execute(INGESTED_FILES_TABLE)
+        loaders = tableLoaders(conn, batchSize, dedupe = not stream)
+        conn.execute('BEGIN')
+        if stream:
+            for json_file in json_files:
+                loadRows(loaders, streamJsonRows(json_file, compact = compact))
+                recordFile(conn, json_file)
+                print("Success parsing " + json_file)
+        else:
+            for i, shard in enumerate(parseShards(json_files, workers, compact)):
+                loadShard(loaders, shard)
+                recordFile(conn, json_files[i])
+                print("Success parsing " + json_files[i])
+        for loader in loaders:
+            loader.flush()
+        conn.execute('COMMIT')
+        finishLoad(conn)
+    finally:
+        conn.close()
+    os.rename(tmp_file, db_file)
+    return dict((loader.table, loader.count) for loader in loaders)
+
+def hasTable(conn, table):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone() is not None
+
+# Returns True if the database was created from create_compact.sql
+def isCompact(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0] == COMPACT_SCHEMA_VERSION
+
+# Returns the hash of json_file if it has to be ingested, or None if it is
+# already recorded unchanged. Files whose size and modification time match
+# their record are skipped without being read.
+def pendingFileHash(conn, json_file):
+    path, size, mtime = fileSignature(json_file)
+    record = conn.execute('SELECT Size, MTime, Hash FROM IngestedFiles WHERE Path = ?', (path,)).fetchone()
+    if record is not None and record[0] == size and record[1] == mtime:
+        return None
+    digest = fileHash(json_file)
+    if record is not None and record[0] == size and record[2] == digest:
+        conn.execute('UPDATE IngestedFiles SET MTime = ? WHERE Path = ?', (mtime, path))
+        return None
+    return digest
+
+# Passes parsed items through, collecting their ItemIDs in itemIDs
+def collectItemIDs(parsedItems, itemIDs):
+    for parsed in parsedItems:
+        itemIDs.append((parsed[0][0],))
+        yield parsed
+
+# Upserts one json file into the database in a single transaction, together
+# with its IngestedFiles record. The triggers are dropped for the duration of
+# the transaction since they only accept bids placed at the current time, and
+# they are recreated before it commits. The file's items are settled again
+# once its bids are in (RESETTLE).
+def ingestFile(conn, json_file, digest, batchSize = BATCH_SIZE, compact = False):
+    loaders = tuple(TableLoader(conn, table, columns, keyColumns, batchSize, False, UPSERTS.get(table))
+                    for table, columns, keyColumns in TABLES)
+    itemIDs = []
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        for trigger in TRIGGERS:
+            conn.execute('DROP TRIGGER IF EXISTS %s' % trigger)
+        loadRows(loaders, collectItemIDs(streamJsonRows(json_file, compact = compact), itemIDs))
+        for loader in loaders:
+            loader.flush()
+        conn.executemany(RESETTLE, itemIDs)
+        recordFile(conn, json_file, digest)
+        for script_file in TRIGGER_FILES:
+            for statement in scriptStatements(script_file):
+                conn.execute(statement)
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    conn.execute('COMMIT')
+    return dict((loader.table, loader.count) for loader in loaders)
+
+# Returns why json files cannot be ingested into db_file, or None if it is a
+# database with the AuctionBase tables
+def ingestProblem(db_file):
+    if not os.path.exists(db_file):
+        return '%s does not exist; load it without --incremental first' % db_file
+    conn = connect(db_file)
+    try:
+        if not hasTable(conn, 'Items'):
+            return '%s has no AuctionBase tables; load it without --incremental first' % db_file
+    except sqlite3.DatabaseError as dbExc:
+        return '%s is not an AuctionBase database (%s)' % (db_file, dbExc)
+    finally:
+        conn.close()
+    return None
+
+# Adds the given json files to an existing database, skipping files that have
+# already been ingested unchanged
+def ingestDatabase(json_files, db_file = DATABASE, batchSize = BATCH_SIZE):
+    problem = ingestProblem(db_file)
+    if problem is not None:
+        raise ValueError(problem)
+    counts = dict((table, 0) for table, columns, keyColumns in TABLES)
+    conn = connect(db_file)
+    try:
+        conn.execute(INGESTED_FILES_TABLE)
+        runScript(conn, INDEX_FILE)
+        if not hasTable(conn, 'ItemsSearch'):
+            runScript(conn, SEARCH_FILE)
+        if not hasTable(conn, 'ItemStatus'):
+            runScript(conn, STATUS_FILE)
+        if not hasTable(conn, 'Settlements'):
+            runScript(conn, SETTLEMENT_FILE)
+        if not hasTable(conn, 'CategoryFacets'):
+            runScript(conn, FACET_FILE)
+        compact = isCompact(conn)
+        for json_file in json_files:
+            digest = pendingFileHash(conn, json_file)
+            if digest is None:
+                print("Skipping unchanged " + json_file)
+                continue
+            for table, count in ingestFile(conn, json_file, digest, batchSize, compact).items():
+                counts[table] += count
+            print("Success ingesting " + json_file)
+    finally:
+        conn.close()
+    return counts
+
+def main(argv):
+    argParser = argparse.ArgumentParser(description = 'Load eBay json files into AuctionBase.')
+    argParser.add_argument('--db', default = DATABASE, help = 'database file to build')
+    argParser.add_argument('--compact', action = 'store_true', help = 'store times and amounts as integers')
+    mode = argParser.add_mutually_exclusive_group()
+    mode.add_argument('--workers', type = int, default = 1, help = 'number of parser processes')
+    mode.add_argument('--stream', action = 'store_true', help = 'read json files incrementally')
+    mode.add_argument('--incremental', action = 'store_true', help = 'add new or changed files to an existing database')
+    argParser.add_argument('files', nargs = '+', help = 'eBay json files')
+    args = argParser.parse_args(argv[1:])
+    json_files = [f for f in args.files if isJson(f)]
+    if args.incremental:
+        problem = ingestProblem(args.db)
+        if problem is not None:
+            argParser.error(problem)
+        counts = ingestDatabase(json_files, args.db)
+    else:
+        counts = loadDatabase(json_files, args.db, workers = args.workers, stream = args.stream,
+                              compact = args.compact)
+    for table in sorted(counts):
+        print('%s: %d rows' % (table, counts[table]))
+
+if __name__ == '__main__':
+    main(sys.argv)
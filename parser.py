@@ -25,11 +25,15 @@ Happy parsing!
 """
 
 import sys
-from json import loads
+from calendar import timegm
+from json import JSONDecoder, loads
 from re import sub
 
 columnSeparator = "|"
 
+# Number of characters read at a time when streaming a json file
+STREAM_CHUNK_SIZE = 1 << 16
+
 # Dictionary of months used for date transformation
 MONTHS = {'Jan':'01','Feb':'02','Mar':'03','Apr':'04','May':'05','Jun':'06',\
         'Jul':'07','Aug':'08','Sep':'09','Oct':'10','Nov':'11','Dec':'12'}
@@ -68,6 +72,33 @@ def transformDollar(money):
         return money
     return sub(r'[^\d.]', '', money)
 
+"""
+Transforms a timestamp from Mon-DD-YY HH:MM:SS to integer seconds since the
+epoch (UTC), for the compact schema in create_compact.sql. The seconds at the
+start of each day are cached, since a data set only spans a few hundred days.
+"""
+DAY_EPOCHS = {}
+
+def dttmToEpoch(dttm):
+    date, clock = dttm.strip().split(' ')
+    day = DAY_EPOCHS.get(date)
+    if day is None:
+        dt = date.split('-')
+        day = timegm((2000 + int(dt[2]), int(transformMonth(dt[0])), int(dt[1]), 0, 0, 0))
+        DAY_EPOCHS[date] = day
+    hh, mm, ss = clock.split(':')
+    return day + int(hh) * 3600 + int(mm) * 60 + int(ss)
+
+"""
+Transforms a dollar value amount from a string like $3,453.23 to integer cents
+(345323), for the compact schema in create_compact.sql
+"""
+def dollarToCents(money):
+    if money == None or len(money) == 0:
+        return None
+    dollars, _, cents = transformDollar(money).partition('.')
+    return int(dollars or '0') * 100 + int((cents + '00')[:2])
+
 """
 Parses a single json file. Currently, there's a loop that iterates over each
 item in the data set. Your job is to extend this functionality to create all
@@ -157,19 +188,154 @@ def parseJson(json_file):
         f3.close()
         f4.close()
 
+"""
+Converts a single item dictionary into the rows it contributes to each table.
+Returns a tuple (item, categories, bids, users) where item is one row and the
+others are lists of rows, with columns in the order declared by create.sql.
+Missing values are returned as None instead of the "-999" / "empty"
+placeholders written to the .dat files, so the rows can be inserted directly.
+With compact set, times and amounts are converted with dttmToEpoch and
+dollarToCents instead of transformDttm and transformDollar.
+"""
+def parseItem(item, compact = False):
+    if compact:
+        dollar, dttm = dollarToCents, dttmToEpoch
+    else:
+        dollar, dttm = transformDollar, transformDttm
+    itemID = item['ItemID']
+    seller = item['Seller']
+    itemRow = (itemID, item['Name'], dollar(item['Currently']),
+               dollar(item['First_Bid']),
+               dollar(item.get('Buy_Price')), item['Number_of_Bids'],
+               dttm(item['Started']), dttm(item['Ends']),
+               seller['UserID'], item['Description'])
+    categoryRows = [(itemID, category) for category in item['Category']]
+    userRows = [(seller['UserID'], seller['Rating'], item['Location'], item['Country'])]
+    bidRows = []
+    if item['Number_of_Bids'] != "0":
+        for bidsIterator in item['Bids']:
+            bid = bidsIterator['Bid']
+            bidder = bid['Bidder']
+            bidRows.append((itemID, bidder['UserID'], dollar(bid['Amount']),
+                            dttm(bid['Time'])))
+            userRows.append((bidder['UserID'], bidder['Rating'],
+                             bidder.get('Location'), bidder.get('Country')))
+    return itemRow, categoryRows, bidRows, userRows
+
+"""
+Loads a single json file and yields the parseItem rows for each of its items
+"""
+def parseJsonRows(json_file, compact = False):
+    with open(json_file, 'r') as f:
+        items = loads(f.read())['Items']
+    for item in items:
+        yield parseItem(item, compact)
+
+"""
+Incremental reader over an open json file. Keeps only the unread part of the
+file in memory: values are decoded one at a time from a buffer that is
+refilled in chunks, and text before the current position is dropped on each
+refill.
+"""
+class JsonStream(object):
+    def __init__(self, f, chunkSize = STREAM_CHUNK_SIZE):
+        self.f = f
+        self.chunkSize = chunkSize
+        self.decoder = JSONDecoder()
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    # Appends at least size more characters to the buffer, returns False at
+    # the end of the file
+    def fill(self, size):
+        chunk = self.f.read(size)
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        self.eof = len(chunk) == 0
+        return not self.eof
+
+    # Returns the next non-whitespace character without consuming it
+    def peek(self):
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in ' \t\n\r':
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill(self.chunkSize):
+                raise ValueError('Unexpected end of json file')
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError('Expected %r in json file' % char)
+        self.pos += 1
+
+    # Consumes the next character if it is a comma
+    def skipComma(self):
+        if self.peek() == ',':
+            self.pos += 1
+
+    # Decodes the next complete json value. Values cut off by the end of the
+    # buffer are retried with a larger read, so a value is never decoded from
+    # a partial chunk.
+    def decode(self):
+        self.peek()
+        size = self.chunkSize
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return value
+            except ValueError:
+                if self.eof:
+                    raise
+            self.fill(size)
+            size *= 2
+
+"""
+Yields the items of a json file of the form {"Items": [...]} one at a time,
+without reading the whole file into memory. Peak memory is bounded by the
+largest item plus one read chunk instead of by the file size.
+"""
+def iterItems(json_file, chunkSize = STREAM_CHUNK_SIZE):
+    with open(json_file, 'r') as f:
+        stream = JsonStream(f, chunkSize)
+        stream.expect('{')
+        while stream.peek() != '}':
+            key = stream.decode()
+            stream.expect(':')
+            if key == 'Items':
+                stream.expect('[')
+                while stream.peek() != ']':
+                    yield stream.decode()
+                    stream.skipComma()
+                stream.expect(']')
+            else:
+                stream.decode()
+            stream.skipComma()
+
+"""
+Streaming version of parseJsonRows: yields the parseItem rows for each item as
+soon as it has been read from the file
+"""
+def streamJsonRows(json_file, chunkSize = STREAM_CHUNK_SIZE, compact = False):
+    for item in iterItems(json_file, chunkSize):
+        yield parseItem(item, compact)
+
 """
 Loops through each json files provided on the command line and passes each file
 to the parser
 """
 def main(argv):
     if len(argv) < 2:
-        print >> sys.stderr, 'Usage: python skeleton_json_parser.py <path to json files>'
+        sys.stderr.write('Usage: python skeleton_json_parser.py <path to json files>\n')
         sys.exit(1)
     # loops over all .json files in the argument
     for f in argv[1:]:
         if isJson(f):
             parseJson(f)
-            print "Success parsing " + f
+            print("Success parsing " + f)
 
 if __name__ == '__main__':
     main(sys.argv)
@@ -0,0 +1,41 @@
+-- description: Full-text index over Items.Name and Items.Description, used by
+-- sqlitedb.searchAuction for keyword, prefix and phrase searches
+
+drop trigger if exists search_insert;
+drop trigger if exists search_delete;
+drop trigger if exists search_update;
+drop table if exists ItemsSearch;
+
+-- external content table: the text is stored once, in Items
+create virtual table ItemsSearch using fts5(
+	Name,
+	Description,
+	content = 'Items',
+	content_rowid = 'ItemID'
+);
+
+insert into ItemsSearch(ItemsSearch) values ('rebuild');
+
+create trigger search_insert
+	after insert on Items
+	for each row
+	begin
+		INSERT INTO ItemsSearch(rowid, Name, Description) VALUES (NEW.ItemID, NEW.Name, NEW.Description);
+	end;
+
+create trigger search_delete
+	after delete on Items
+	for each row
+	begin
+		INSERT INTO ItemsSearch(ItemsSearch, rowid, Name, Description) VALUES ('delete', OLD.ItemID, OLD.Name, OLD.Description);
+	end;
+
+-- only changes to the indexed text need reindexing, not the price and bid
+-- count updates made by every bid
+create trigger search_update
+	after update of ItemID, Name, Description on Items
+	for each row
+	begin
+		INSERT INTO ItemsSearch(ItemsSearch, rowid, Name, Description) VALUES ('delete', OLD.ItemID, OLD.Name, OLD.Description);
+		INSERT INTO ItemsSearch(rowid, Name, Description) VALUES (NEW.ItemID, NEW.Name, NEW.Description);
+	end;
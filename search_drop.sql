@@ -0,0 +1,4 @@
+drop trigger search_insert;
+drop trigger search_delete;
+drop trigger search_update;
+drop table ItemsSearch;
@@ -0,0 +1,76 @@
+-- description: Settlements of closed auctions: the winning bidder, the final
+-- price and the time the auction closed, recorded once when the auction
+-- closes instead of being looked up in Bids on every page view. Auctions
+-- that close without bids are recorded with a null winner and price.
+-- Requires ItemStatus (status_add.sql).
+
+drop trigger if exists settle_insert;
+drop trigger if exists settle_status;
+drop trigger if exists settle_delete;
+drop trigger if exists settle_time;
+drop table if exists Settlements;
+
+-- Price and Closed are copied from Bids and Items, and stored as they are
+-- stored there (text or compact schema)
+create table Settlements (
+	ItemID INTEGER,
+	Winner_UserID TEXT,
+	Price,
+	Closed,
+	PRIMARY KEY(ItemID)
+);
+
+-- an auction that reached its buy price closed with its last bid, any other
+-- closed auction at its end time
+insert into Settlements
+	select i.ItemID,
+		(SELECT b.UserID FROM Bids b WHERE b.ItemID = i.ItemID ORDER BY b.Amount DESC LIMIT 1),
+		(SELECT MAX(b.Amount) FROM Bids b WHERE b.ItemID = i.ItemID),
+		CASE WHEN (IFNULL(i.Currently, i.First_Bid) >= i.Buy_Price) IS 1
+		     THEN IFNULL((SELECT MAX(b.Time) FROM Bids b WHERE b.ItemID = i.ItemID), i.Started)
+		     ELSE i.Ends END
+	from Items i join ItemStatus s on s.ItemID = i.ItemID
+	where s.Status = 'close';
+
+create index Settlements_Winner_UserID on Settlements(Winner_UserID);
+create index Settlements_Closed on Settlements(Closed);
+
+-- The status of an auction is stored when it is added and changes when a bid
+-- reaches its buy price (settled at the time of that bid), when the clock
+-- moves past its end (status_time) or when an incremental load changes its
+-- price or times. Status changes of ItemStatus rows, not every bid, fire these.
+create trigger settle_insert
+	after insert on ItemStatus
+	for each row when (NEW.Status = 'close')
+	begin
+		INSERT OR IGNORE INTO Settlements
+			SELECT i.ItemID,
+				(SELECT b.UserID FROM Bids b WHERE b.ItemID = i.ItemID ORDER BY b.Amount DESC LIMIT 1),
+				(SELECT MAX(b.Amount) FROM Bids b WHERE b.ItemID = i.ItemID),
+				CASE WHEN (IFNULL(i.Currently, i.First_Bid) >= i.Buy_Price) IS 1
+				     THEN IFNULL((SELECT MAX(b.Time) FROM Bids b WHERE b.ItemID = i.ItemID), i.Started)
+				     ELSE i.Ends END
+			FROM Items i WHERE i.ItemID = NEW.ItemID;
+	end;
+
+create trigger settle_status
+	after update of Status on ItemStatus
+	for each row when (OLD.Status IS NOT NEW.Status)
+	begin
+		INSERT OR IGNORE INTO Settlements
+			SELECT i.ItemID,
+				(SELECT b.UserID FROM Bids b WHERE b.ItemID = i.ItemID ORDER BY b.Amount DESC LIMIT 1),
+				(SELECT MAX(b.Amount) FROM Bids b WHERE b.ItemID = i.ItemID),
+				CASE WHEN (IFNULL(i.Currently, i.First_Bid) >= i.Buy_Price) IS 1
+				     THEN IFNULL((SELECT MAX(b.Time) FROM Bids b WHERE b.ItemID = i.ItemID), i.Started)
+				     ELSE i.Ends END
+			FROM Items i WHERE i.ItemID = NEW.ItemID AND NEW.Status = 'close';
+		DELETE FROM Settlements WHERE ItemID = NEW.ItemID AND NEW.Status != 'close';
+	end;
+
+create trigger settle_delete
+	after delete on ItemStatus
+	for each row
+	begin
+		DELETE FROM Settlements WHERE ItemID = OLD.ItemID;
+	end;
@@ -0,0 +1,4 @@
+drop trigger settle_insert;
+drop trigger settle_delete;
+drop trigger settle_status;
+drop table Settlements;
@@ -0,0 +1,81 @@
+-- description: Stored status of every auction ('notStarted', 'open' or
+-- 'close'), used by sqlitedb.searchAuction and the item page instead of
+-- comparing Started, Ends and Buy_Price with the current time on every request.
+-- An auction is closed once it has ended or its price has reached the buy
+-- price, and not started before its start time.
+
+drop trigger if exists status_insert;
+drop trigger if exists status_delete;
+drop trigger if exists status_update;
+drop trigger if exists status_time;
+drop table if exists ItemStatus;
+
+create table ItemStatus (
+	ItemID INTEGER,
+	Status TEXT,
+	PRIMARY KEY(ItemID)
+) without rowid;
+
+insert into ItemStatus
+	select ItemID,
+		CASE WHEN (IFNULL(Currently, First_Bid) >= Buy_Price) IS 1 OR Ends < c.Time THEN 'close'
+		     WHEN Started > c.Time THEN 'notStarted'
+		     ELSE 'open' END
+	from Items, CurrentTime c;
+
+create index ItemStatus_Status on ItemStatus(Status);
+
+create trigger status_insert
+	after insert on Items
+	for each row
+	begin
+		INSERT INTO ItemStatus
+			SELECT NEW.ItemID,
+				CASE WHEN (IFNULL(NEW.Currently, NEW.First_Bid) >= NEW.Buy_Price) IS 1 OR NEW.Ends < c.Time THEN 'close'
+				     WHEN NEW.Started > c.Time THEN 'notStarted'
+				     ELSE 'open' END
+			FROM CurrentTime c;
+	end;
+
+create trigger status_delete
+	after delete on Items
+	for each row
+	begin
+		DELETE FROM ItemStatus WHERE ItemID = OLD.ItemID;
+	end;
+
+-- bids raise Currently, which closes the auction once it reaches Buy_Price.
+-- The row is updated in place, so that the triggers on ItemStatus only see a
+-- change when the status actually changes, not on every bid.
+create trigger status_update
+	after update of ItemID, Currently, First_Bid, Buy_Price, Started, Ends on Items
+	for each row
+	begin
+		UPDATE ItemStatus
+			SET ItemID = NEW.ItemID,
+				Status = (SELECT
+					CASE WHEN (IFNULL(NEW.Currently, NEW.First_Bid) >= NEW.Buy_Price) IS 1 OR NEW.Ends < c.Time THEN 'close'
+					     WHEN NEW.Started > c.Time THEN 'notStarted'
+					     ELSE 'open' END
+					FROM CurrentTime c)
+			WHERE ItemID = OLD.ItemID;
+	end;
+
+-- moving the clock only changes the auctions that start or end in between
+-- the old and the new time, which are found with the Items_Started and
+-- Items_Ends indexes
+create trigger status_time
+	after update of Time on CurrentTime
+	for each row
+	begin
+		UPDATE ItemStatus
+			SET Status = (SELECT
+				CASE WHEN (IFNULL(i.Currently, i.First_Bid) >= i.Buy_Price) IS 1 OR i.Ends < NEW.Time THEN 'close'
+				     WHEN i.Started > NEW.Time THEN 'notStarted'
+				     ELSE 'open' END
+				FROM Items i WHERE i.ItemID = ItemStatus.ItemID)
+			WHERE ItemID IN (
+				SELECT ItemID FROM Items WHERE Started > MIN(OLD.Time, NEW.Time) AND Started <= MAX(OLD.Time, NEW.Time)
+				UNION
+				SELECT ItemID FROM Items WHERE Ends >= MIN(OLD.Time, NEW.Time) AND Ends < MAX(OLD.Time, NEW.Time));
+	end;
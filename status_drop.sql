@@ -0,0 +1,5 @@
+drop trigger status_insert;
+drop trigger status_delete;
+drop trigger status_update;
+drop trigger status_time;
+drop table ItemStatus;
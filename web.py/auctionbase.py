@@ -14,6 +14,10 @@ from datetime import datetime
 
 ######################BEGIN HELPER METHODS######################
 
+import json
+import traceback
+from jinja2 import FileSystemBytecodeCache
+
 # helper method to convert times from database (which will return a string)
 # into datetime objects. This will allow you to compare times correctly (using
 # ==, !=, <, >, etc.) instead of lexicographically as strings.
@@ -24,6 +28,47 @@ from datetime import datetime
 def string_to_time(date_str):
     return datetime.strptime(date_str, '%Y-%m-%d %H:%M:%S')
 
+# set RELOAD_TEMPLATES to True while editing templates: pages then check the
+# template files for changes on every request. Otherwise each template is read
+# and compiled once per process, and the compiled code is also kept in a
+# bytecode cache on disk (in the system's temporary directory) so that a newly
+# started server does not compile them again.
+RELOAD_TEMPLATES = False
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(__file__), 'templates')
+
+# Jinja2 environments shared by all requests, one for each list of extensions
+jinja_envs = {}
+
+def template_env(extensions):
+    key = tuple(extensions)
+    jinja_env = jinja_envs.get(key)
+    if jinja_env is None:
+        jinja_env = Environment(autoescape=True,
+                loader=FileSystemLoader(TEMPLATE_DIR),
+                extensions=extensions,
+                auto_reload=RELOAD_TEMPLATES,
+                bytecode_cache=FileSystemBytecodeCache(),
+                )
+        jinja_env = jinja_envs.setdefault(key, jinja_env)
+    return jinja_env
+
+# compiles every template ahead of the first request (see serve.py)
+def load_templates():
+    jinja_env = template_env([])
+    for template_name in jinja_env.list_templates():
+        jinja_env.get_template(template_name)
+
+# looks up the template for render_template and stream_template; `globals' are
+# passed along with the context, since the environment is shared
+def get_template(template_name, context):
+    extensions = context.pop('extensions', [])
+    globals = context.pop('globals', {})
+
+    web.header('Content-Type','text/html; charset=utf-8', unique=True)
+
+    return template_env(extensions).get_template(template_name), dict(globals, **context)
+
 # helper method to render a template in the templates/ directory
 #
 # `template_name': name of template file to render
@@ -35,18 +80,51 @@ def string_to_time(date_str):
 #
 # WARNING: DO NOT CHANGE THIS METHOD
 def render_template(template_name, **context):
-    extensions = context.pop('extensions', [])
-    globals = context.pop('globals', {})
-
-    jinja_env = Environment(autoescape=True,
-            loader=FileSystemLoader(os.path.join(os.path.dirname(__file__), 'templates')),
-            extensions=extensions,
-            )
-    jinja_env.globals.update(globals)
-
-    web.header('Content-Type','text/html; charset=utf-8', unique=True)
-
-    return jinja_env.get_template(template_name).render(context)
+    template, context = get_template(template_name, context)
+    return template.render(context)
+
+# streaming version of render_template: returns an iterator over the rendered
+# page, which web.py sends to the client piece by piece as the template is
+# rendered, so long pages are never built up in memory
+def stream_template(template_name, **context):
+    template, context = get_template(template_name, context)
+    return chunked(template.generate(context))
+
+# Streamed pages are sent in chunks of about this many characters. Jinja2
+# yields every bit of text between two tags on its own, and writing each of
+# them to the socket separately made a page of search results ten times
+# slower to send than to render.
+STREAM_CHUNK_SIZE = 16384
+
+def chunked(pieces):
+    chunk = []
+    size = 0
+    for piece in pieces:
+        chunk.append(piece)
+        size += len(piece)
+        if size >= STREAM_CHUNK_SIZE:
+            yield ''.join(chunk)
+            chunk = []
+            size = 0
+    if chunk:
+        yield ''.join(chunk)
+
+# set USE_ORDER_BOOK to True to take bids through the in-memory order book in
+# orderbook.py, which writes accepted bids to the database in batches instead
+# of one transaction per bid
+USE_ORDER_BOOK = False
+
+import orderbook
+orderBook = orderbook.OrderBook().start() if USE_ORDER_BOOK else None
+
+# set USE_METRICS to True to time queries for the /metrics page. Timing tags
+# every statement with the helper that ran it, so it is off by default; serve.py
+# follows this setting unless --metrics or --no-metrics is given
+USE_METRICS = False
+
+import metrics
+if USE_METRICS:
+    metrics.enable()
 
 #####################END HELPER METHODS#####################
 
@@ -57,6 +135,13 @@ urls = ('/currtime', 'curr_time',
         '/items', 'item_status',
         '/add_bid', 'place_bid',
         '/appbase', 'appbase',
+        '/metrics', 'metrics_page',
+        '/api/search', 'api_search',
+        '/api/items', 'api_item',
+        '/api/bids', 'api_bid_history',
+        '/api/bid', 'api_bid',
+        '/api/items/batch', 'api_item_batch',
+        '/api/bids/batch', 'api_bid_batch',
         )
 
 class curr_time:
@@ -65,7 +150,7 @@ class curr_time:
     # Notice that we pass in `current_time' to our `render_template' call
     # in order to have its value displayed on the web page
     def GET(self):
-        current_time = sqlitedb.getTime()
+        current_time = sqlitedb.timeFromDb(sqlitedb.getTime())
         return render_template('curr_time.html', time = current_time)
 
 class select_time:
@@ -116,14 +201,32 @@ class search_auction:
         minPrice = post_params['minPrice']
         maxPrice = post_params['maxPrice']
         status = post_params['status']
+        #paging options; the cursor is set when asking for the page after a previous one
+        order = post_params.get('order', '')
+        pageSize = post_params.get('pageSize', '') or sqlitedb.SEARCH_PAGE_SIZE
+        includeDescription = 'hideDescription' not in post_params
+        cursor = post_params.get('cursor', '')
 
         #error check if user actually inputted stuff in
         if userID == '' and itemID == '' and category == '' and description == '' and minPrice == '' and maxPrice == '':
             return render_template('search.html', message = 'All of the queries are missing a value. Please try again.')
         else:
-            #search the database based on the user input, and return the results to search.html
-            val = sqlitedb.searchAuction(userID,itemID,category,description,minPrice,maxPrice,status)
-            return render_template('search.html', search_result = val)
+            #search the database based on the user input, and stream one page of results through search.html
+            try:
+                val = sqlitedb.searchAuctionPage(userID,itemID,category,description,minPrice,maxPrice,status,cursor,pageSize,order,includeDescription)
+            except ValueError:
+                return render_template('search.html', message = 'Invalid page of results. Please search again.')
+            #the item counts by category are read from the precomputed facets, whatever the search
+            facets = sqlitedb.getCategoryFacets(status)
+            categoryCounts = sqlitedb.getCategoryCounts(category) if category else None
+            #the search parameters are repeated in the form that asks for the next page
+            params = dict(post_params)
+            params.pop('cursor', None)
+            return stream_template('search.html', search_result = val, params = params, facets = facets,
+                                   category_counts = categoryCounts, status_names = ITEM_STATUS_NAMES)
+
+#How each stored auction status is shown on the item page
+ITEM_STATUS_NAMES = {'notStarted': 'Not yet started', 'open': 'Still open', 'close': 'Ended'}
 
 class item_status:
     #Get request to URL '/items'
@@ -132,44 +235,50 @@ class item_status:
         post_params = web.input()
         itemID = post_params['id']
 
-        #retrieve status and bidding information for the specific itemID
-        item = sqlitedb.getItemById(itemID)
-        categories = sqlitedb.getCategoryById(itemID)
-        bids = sqlitedb.getBidById(itemID)
+        #retrieve status and bidding information for the specific itemID in one snapshot
+        item = sqlitedb.getItemSnapshot(itemID)
 
-        #initialize items to not yet ended and no buy price, and therefore, no winner
-        ended = False
+        #initialize items to no buy price, and therefore, no winner
         hasBuyPrice = False
         winner = ""
         buyPrice = ""
 
-        #check and update the status of the auction
-        if item.Started <= sqlitedb.getTime() and item.Ends >= sqlitedb.getTime():
-            status = 'Still open'
-        elif item.Started > sqlitedb.getTime():
-            status = 'Not yet started'
-        else:
-            #at this point, item's end time is already after current time
-            status = 'Ended'
+        #the status of the auction is stored; it is closed once it has ended or reached its buy price
+        ended = item.Status == 'close'
+        status = ITEM_STATUS_NAMES[item.Status]
 
-        #get a winner if one exists
+        #get a winner if one exists; closed auctions were settled when they closed
         if item.Number_of_Bids == 0:
             noBids = True
         else:
             noBids = False
-            winner = sqlitedb.getWinnerById(itemID).UserID
+            winner = item.Leader
 
-        #if bid price is higher than buy price, then close the auction
         if item.Buy_Price is not None:
             hasBuyPrice = True
-            buyPrice = item.Buy_Price
-            if status == 'Ended' or float(item.Currently) >= float(item.Buy_Price):
-                status = 'Ended'
-                ended = True
-        elif status == 'Ended':
-            ended = True
-
-        return render_template('items.html', id = itemID, bids = bids, Name = item.Name, Category = categories.Category, Ends = item.Ends, Started = item.Started, Number_of_Bids = item.Number_of_Bids, Seller = item.Seller_UserID, Description = item.Description, Currently = item.Currently, noBids = noBids, ended = ended, Status = status, Winner = winner, buyPrice = buyPrice, hasBuyPrice = hasBuyPrice)
+            buyPrice = sqlitedb.moneyFromDb(item.Buy_Price)
+
+        return stream_template('items.html', id = itemID, bids = item.Bids, Name = item.Name, Category = item.Category, Ends = sqlitedb.timeFromDb(item.Ends), Started = sqlitedb.timeFromDb(item.Started), Number_of_Bids = item.Number_of_Bids, Seller = item.Seller_UserID, Description = item.Description, Currently = sqlitedb.moneyFromDb(item.Currently), noBids = noBids, ended = ended, Status = status, Winner = winner, buyPrice = buyPrice, hasBuyPrice = hasBuyPrice, Closed = sqlitedb.timeFromDb(item.Closed))
+
+#Messages for the reasons sqlitedb.placeBid rejects a bid
+BID_REJECTIONS = {
+    'invalid': 'At least one of the following is invalid: UserID, ItemID, or Amount.',
+    'noUser': 'Could not find user with UserID.',
+    'seller': 'UserID is the ID of the seller, cannot bid.',
+    'noItem': 'Could not find item with ItemID.',
+    'negative': 'The specified amount is negative.',
+    'tooSmall': 'The specified amount is too small.',
+    'notStarted': 'The auction has not yet started.',
+    'ended': 'The auction has already ended.',
+    'closing': 'The server is shutting down; please place the bid again shortly.',
+}
+
+#Bids of a user that the order book accepted but could not write, to be shown to the user once
+def failed_bids(userID):
+    if orderBook is None:
+        return []
+    return [{'ItemID': bid[0], 'Amount': api_money(bid[2]), 'Time': sqlitedb.timeFromDb(bid[3])}
+            for bid in orderBook.takeFailedBids(userID)]
 
 class place_bid:
     #Get request to URL '/add_bid'
@@ -184,48 +293,199 @@ class place_bid:
         itemID = post_params['itemID']
         Amount = post_params['price']
 
-        #error check if all values were input
-        if userID == '' or itemID == '' or Amount == '':
-            return render_template('add_bid.html', message = 'At least one of the following is invalid: UserID, ItemID, or Amount.')
-        else:
-            #if all values present, retrieve the specified users and items if possible
-            curr_user = sqlitedb.getUserById(userID)
-            curr_item = sqlitedb.getItemById(itemID)
-        
-        #if the specified user doesn't exist:
-        if curr_user is None:
-            return render_template('add_bid.html', message = 'Could not find user with UserID.')
-        #if the specified user is the item's seller:
-        elif curr_user.UserID == curr_item.Seller_UserID:
-            return render_template('add_bid.html', message = 'UserID is the ID of the seller, cannot bid.')
-        #if the specified item doesn't exist:
-        elif curr_item is None:
-            return render_template('add_bid.html', message = 'Could not find item with ItemID.')
-        #if the specified amount is negative:
-        elif float(Amount) < 0:
-            return render_template('add_bid.html', message = 'The specified amount is negative.')
-        #if the specified amount is less than the currently highest bid price:
-        elif float(Amount) <= float(curr_item.First_Bid) or float(Amount) <= float(curr_item.Currently):
-            return render_template('add_bid.html', message = 'The specified amount is too small.')
-        #if the specified auction has not yet started:
-        elif string_to_time(sqlitedb.getTime()) < string_to_time(curr_item.Started):
-            return render_template('add_bid.html', message = 'The auction has not yet started.')
-        #if the specified auction has already ended:
-        elif string_to_time(sqlitedb.getTime()) >= string_to_time(curr_item.Ends):
-            return render_template('add_bid.html', message = 'The auction has already ended.')
-
-        #If the auction has a specified buy price:
-        if curr_item.Buy_Price is not None:
-            #if specified amount is greater than or equal to buy price:
-            if float(Amount) >= float(curr_item.Buy_Price):
-                #indicate that the auction has been purchased, and close the auction (IF SUCCESSFUL).
-                #On the website, if the Result specifies "not successful", then this step has not been successful due to constraints.
-                successful_purchase = 'You have purchased item: %s for: %s. NOTE: Check Result below to see if it was successful.' % (curr_item.Name, Amount)
-                return render_template('add_bid.html', message = successful_purchase, add_result = sqlitedb.newBid(userID, itemID, Amount))
-
-        #place a new bid on the item with the specified amount
+        #check the bid against the user, the item and the current time, and place it if it passes
+        outcome, curr_item, added = (orderBook or sqlitedb).placeBid(userID, itemID, Amount)
+        failed = failed_bids(userID)
+        if outcome not in ('bid', 'purchase'):
+            return render_template('add_bid.html', message = BID_REJECTIONS[outcome], failed_bids = failed)
+
+        #if the amount reached the buy price, the item has been purchased and the auction is closed (IF SUCCESSFUL).
+        #On the website, if the Result specifies "not successful", then this step has not been successful due to constraints.
+        if outcome == 'purchase':
+            successful_purchase = 'You have purchased item: %s for: %s. NOTE: Check Result below to see if it was successful.' % (curr_item.Name, Amount)
+            return render_template('add_bid.html', message = successful_purchase, add_result = added, failed_bids = failed)
+
+        #otherwise a new bid was placed on the item with the specified amount
         successful_bid = 'You have placed a bid on item: %s for: %s. NOTE: Check Result below to see if it was successful.' % (curr_item.Name, Amount)
-        return render_template('add_bid.html', message = successful_bid, add_result = sqlitedb.newBid(userID, itemID, Amount))
+        return render_template('add_bid.html', message = successful_bid, add_result = added, failed_bids = failed)
+
+##########################JSON API##########################
+#
+# The same operations as the pages above, for programs rather than browsers:
+#
+#   GET  /api/search         search parameters as in the search form (all optional, at least one
+#                            filter needed); NDJSON, one {"item": ...} line per result, then a
+#                            {"next": cursor} line (null on the last page)
+#   GET  /api/items?id=      one item as a JSON object, with its bid history
+#   GET  /api/bids?id=       the bid history of an item as NDJSON, read one bid at a time
+#   POST /api/bid            userID, itemID and price as a form or a JSON object; returns the outcome
+#                            (with failedBids, the user's earlier bids that the order book could
+#                            not write, when there are any)
+#   POST /api/items/batch    a JSON list of item IDs; NDJSON, one item (or error) per ID
+#   POST /api/bids/batch     a JSON list of bids like /api/bid takes; NDJSON, one outcome per bid
+#
+# Amounts are strings with two decimals and times are 'YYYY-MM-DD HH:MM:SS' in either schema.
+
+#largest number of item IDs or bids in one batch request
+MAX_API_BATCH = 1000
+
+#statuses a search can ask for
+SEARCH_STATUSES = ('open', 'close', 'notStarted', 'all')
+
+#search result columns that hold amounts
+API_MONEY_COLUMNS = ('First Bid', 'Current Price', 'Buy Price')
+
+#an amount as shown on the pages, and an amount as stored in the database, as a string with two decimals
+def api_amount(value):
+    return None if value is None else '%.2f' % float(value)
+
+def api_money(value):
+    return api_amount(sqlitedb.moneyFromDb(value))
+
+def api_error(status, message):
+    return web.HTTPError(status, {'Content-Type': 'application/json'}, json.dumps({'error': message}))
+
+def api_json(value):
+    web.header('Content-Type', 'application/json', unique=True)
+    return json.dumps(value)
+
+#streams an iterator of JSON values as NDJSON, one value per line
+def api_ndjson(values):
+    web.header('Content-Type', 'application/x-ndjson', unique=True)
+    return chunked(json.dumps(value) + '\n' for value in values)
+
+#reads a JSON request body, or the form if the request is not JSON
+def api_body():
+    if web.ctx.env.get('CONTENT_TYPE', '').startswith('application/json'):
+        try:
+            return json.loads(web.data())
+        except ValueError:
+            raise api_error('400 Bad Request', 'The request body is not valid JSON.')
+    return dict(web.input())
+
+def api_batch():
+    batch = api_body()
+    if not isinstance(batch, list):
+        raise api_error('400 Bad Request', 'The request body must be a JSON list.')
+    if len(batch) > MAX_API_BATCH:
+        raise api_error('413 Request Entity Too Large', 'At most %d entries fit in one batch.' % MAX_API_BATCH)
+    return batch
+
+def item_json(item):
+    return {
+        'ItemID': item.ItemID,
+        'Name': item.Name,
+        'Category': item.Category.split(', ') if item.Category else [],
+        'Seller_UserID': item.Seller_UserID,
+        'Description': item.Description,
+        'Started': sqlitedb.timeFromDb(item.Started),
+        'Ends': sqlitedb.timeFromDb(item.Ends),
+        'First_Bid': api_money(item.First_Bid),
+        'Currently': api_money(item.Currently),
+        'Buy_Price': api_money(item.Buy_Price),
+        'Number_of_Bids': item.Number_of_Bids,
+        'Status': item.Status,
+        'Leader': item.Leader,
+        'Closed': sqlitedb.timeFromDb(item.Closed),
+        'Bids': [bid_json(bid) for bid in item.Bids],
+    }
+
+#a bid with the columns of getBidById
+def bid_json(bid):
+    return {'UserID': bid['User ID'], 'Time': bid['Bid Time'], 'Amount': api_amount(bid['Bid Price'])}
+
+#values a bid field can take in a JSON bid: text or a number (json gives text as unicode in Python 2)
+try:
+    API_BID_FIELD_TYPES = (basestring, int, long, float)
+except NameError:
+    API_BID_FIELD_TYPES = (str, int, float)
+
+#places one bid given as a JSON object or form and returns its outcome; errors other than the
+#rejections in BID_REJECTIONS are logged and answered with a fixed message
+def place_bid_json(bid):
+    if not isinstance(bid, dict):
+        return {'outcome': 'invalid', 'added': False, 'error': BID_REJECTIONS['invalid']}
+    userID, itemID, price = [bid.get(name, '') for name in ('userID', 'itemID', 'price')]
+    if any(isinstance(value, bool) or not isinstance(value, API_BID_FIELD_TYPES) for value in (userID, itemID, price)):
+        return {'itemID': itemID, 'userID': userID, 'price': price, 'outcome': 'invalid', 'added': False,
+                'error': BID_REJECTIONS['invalid']}
+    try:
+        outcome, item, added = (orderBook or sqlitedb).placeBid(userID, itemID, price)
+    except Exception:
+        traceback.print_exc()
+        return {'itemID': itemID, 'userID': userID, 'price': price, 'outcome': 'error', 'added': False,
+                'error': 'The bid could not be placed.'}
+    result = {'itemID': itemID, 'userID': userID, 'price': price, 'outcome': outcome, 'added': added}
+    if outcome in BID_REJECTIONS:
+        result['error'] = BID_REJECTIONS[outcome]
+    failed = failed_bids(userID)
+    if failed:
+        result['failedBids'] = failed
+    return result
+
+class api_search:
+    def GET(self):
+        params = web.input()
+        filters = [params.get(name, '') for name in ('userID', 'itemID', 'category', 'description', 'minPrice', 'maxPrice')]
+        if not any(filters):
+            raise api_error('400 Bad Request', 'All of the queries are missing a value.')
+        status = params.get('status', '') or 'all'
+        if status not in SEARCH_STATUSES:
+            raise api_error('400 Bad Request', 'Status must be one of %s.' % ', '.join(SEARCH_STATUSES))
+        try:
+            page = sqlitedb.searchAuctionPage(*filters + [status, params.get('cursor', ''),
+                                              params.get('pageSize', '') or sqlitedb.SEARCH_PAGE_SIZE,
+                                              params.get('order', ''), 'hideDescription' not in params])
+        except ValueError:
+            raise api_error('400 Bad Request', 'Invalid page of results.')
+        return api_ndjson(self.lines(page))
+
+    def lines(self, page):
+        for row in page:
+            row = dict(row)
+            for column in API_MONEY_COLUMNS:
+                row[column] = api_amount(row[column])
+            yield {'item': row}
+        yield {'next': page.nextCursor}
+
+class api_item:
+    def GET(self):
+        item = sqlitedb.getItemSnapshot(web.input(id = '').id)
+        if item is None:
+            raise api_error('404 Not Found', 'Could not find item with ItemID.')
+        return api_json(item_json(item))
+
+class api_bid_history:
+    def GET(self):
+        itemID = web.input(id = '').id
+        if sqlitedb.getItemById(itemID) is None:
+            raise api_error('404 Not Found', 'Could not find item with ItemID.')
+        return api_ndjson(bid_json(bid) for bid in sqlitedb.iterBidsById(itemID))
+
+class api_bid:
+    def POST(self):
+        return api_json(place_bid_json(api_body()))
+
+class api_item_batch:
+    def POST(self):
+        return api_ndjson(self.lines(api_batch()))
+
+    def lines(self, ids):
+        for itemID in ids:
+            item = sqlitedb.getItemSnapshot(itemID) if not isinstance(itemID, (list, dict)) else None
+            yield item_json(item) if item is not None else {'ItemID': itemID, 'error': 'Could not find item with ItemID.'}
+
+class api_bid_batch:
+    def POST(self):
+        return api_ndjson(place_bid_json(bid) for bid in api_batch())
+
+#Request and query timings, trigger rejections and cache figures in Prometheus' text format
+class metrics_page:
+    def GET(self):
+        if not metrics.isEnabled():
+            raise web.notfound()
+        web.header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8', unique=True)
+        return metrics.render(orderBook)
 
 ###########################################################################################
 ##########################DO NOT CHANGE ANYTHING BELOW THIS LINE!##########################
@@ -0,0 +1,216 @@
+import bisect
+import re
+import sys
+import threading
+import time
+
+import web
+import sqlitedb
+
+# Request and query timing for the /metrics page, in Prometheus' text format.
+#
+# enable() sets sqlitedb.statementTimer, which then times every statement
+# (tagged with the sqlitedb helper that ran it) and counts the statements the
+# triggers rejected; requestTimer() returns a web.py processor that times
+# every request by route. Statements that take SLOW_QUERY_SECONDS or longer
+# are written to stderr with their EXPLAIN QUERY PLAN. Metrics are off unless
+# USE_METRICS in auctionbase.py or --metrics in serve.py turns them on; while
+# they are off the timer is not set and the processor is not added, so nothing
+# is measured at all.
+
+# Upper bounds, in seconds, of the histogram buckets
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+SLOW_QUERY_SECONDS = 0.1
+
+HELP = {
+    'auctionbase_request_seconds': 'Time to answer a request, by route and status.',
+    'auctionbase_query_seconds': 'Time to run a statement, by the sqlitedb helper that ran it.',
+    'auctionbase_trigger_rejections_total': 'Statements rejected by a trigger, by the trigger\'s message.',
+    'auctionbase_slow_queries_total': 'Statements that took SLOW_QUERY_SECONDS or longer.',
+    'auctionbase_cache_hits_total': 'Lookups answered from a result cache.',
+    'auctionbase_cache_misses_total': 'Lookups a result cache could not answer.',
+    'auctionbase_cache_invalidations_total': 'Times a result cache was invalidated.',
+    'auctionbase_cache_entries': 'Results held by a result cache.',
+    'auctionbase_orderbook_bids_total': 'Bids taken by the order book, by what became of them.',
+    'auctionbase_orderbook_batches_total': 'Batches of bids the order book has written.',
+    'auctionbase_orderbook_pending': 'Accepted bids waiting to be written.',
+    'auctionbase_orderbook_items': 'Auctions the order book keeps in memory.',
+}
+
+# Functions in sqlitedb that run statements for the other helpers; a statement
+# is tagged with the first function outside these that led to it
+STATEMENT_RUNNERS = ('query', 'iterQuery', 'preparedQuery', 'preparedMany', 'runPrepared', 'runPreparedMany',
+                     'timeStatement', '_db_execute', 'transaction')
+SKIPPED_MODULES = ('metrics', 'web.db', 'web.utils')
+
+TRIGGER_MESSAGE = re.compile(r'Trigger\d+_Failed')
+
+class Histogram(object):
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.sum += seconds
+
+# histograms and counters by (name, labels), labels being a tuple of
+# (label, value) pairs
+histograms = {}
+counters = {}
+lock = threading.Lock()
+
+def observe(name, labels, seconds):
+    with lock:
+        histogram = histograms.get((name, labels))
+        if histogram is None:
+            histogram = histograms[(name, labels)] = Histogram()
+        histogram.observe(seconds)
+
+def increment(name, labels, n = 1):
+    with lock:
+        counters[(name, labels)] = counters.get((name, labels), 0) + n
+
+def enable():
+    sqlitedb.statementTimer = recordStatement
+
+def disable():
+    sqlitedb.statementTimer = None
+
+def isEnabled():
+    return sqlitedb.statementTimer is not None
+
+#####################STATEMENTS#####################
+
+# returns the name of the helper a statement was run for
+def caller():
+    frame = sys._getframe(2)
+    while frame is not None:
+        module = frame.f_globals.get('__name__')
+        name = frame.f_code.co_name
+        if module == 'sqlitedb':
+            if name not in STATEMENT_RUNNERS:
+                return name
+        elif module not in SKIPPED_MODULES:
+            return '%s.%s' % (module, name)
+        frame = frame.f_back
+    return 'other'
+
+# sqlitedb.statementTimer: records the time of a statement and whether a
+# trigger rejected it, and logs it if it was slow
+def recordStatement(query_string, params, seconds, error):
+    helper = caller()
+    observe('auctionbase_query_seconds', (('helper', helper),), seconds)
+    if error is not None:
+        rejected = TRIGGER_MESSAGE.search(str(error))
+        if rejected:
+            increment('auctionbase_trigger_rejections_total', (('trigger', rejected.group()),))
+    elif seconds >= SLOW_QUERY_SECONDS:
+        increment('auctionbase_slow_queries_total', ())
+        logSlowQuery(helper, query_string, params, seconds)
+
+def logSlowQuery(helper, query_string, params, seconds):
+    try:
+        plan = sqlitedb.explainStatement(query_string, params)
+    except Exception as explainExc:
+        plan = ['(no plan: %s)' % explainExc]
+    if isinstance(query_string, web.db.SQLQuery):
+        query_string, params = query_string.query(), query_string.values()
+    lines = ['slow query (%.3fs, %s): %s' % (seconds, helper, ' '.join(str(query_string).split()))]
+    if params:
+        lines.append('    parameters: %r' % (params,))
+    lines.extend('    ' + line for line in plan)
+    sys.stderr.write('\n'.join(lines) + '\n')
+
+#####################REQUESTS#####################
+
+# Returns a web.py processor that times every request by method and path;
+# paths other than the given ones are counted together as 'other'
+def requestTimer(paths):
+    paths = frozenset(paths)
+
+    def processor(handler):
+        start = time.time()
+        route = '%s %s' % (web.ctx.method, web.ctx.path if web.ctx.path in paths else 'other')
+        try:
+            result = handler()
+        except web.HTTPError:
+            observeRequest(route, start)
+            raise
+        except Exception:
+            observeRequest(route, start, '500')
+            raise
+        if hasattr(result, '__next__') or hasattr(result, 'next'):
+            #a streamed page is timed once it has been sent
+            return timedIterator(result, route, start)
+        observeRequest(route, start)
+        return result
+    return processor
+
+def timedIterator(result, route, start):
+    status = web.ctx.status
+    try:
+        for chunk in result:
+            yield chunk
+    finally:
+        observeRequest(route, start, status)
+
+def observeRequest(route, start, status = None):
+    status = (status or web.ctx.status).split()[0]
+    observe('auctionbase_request_seconds', (('route', route), ('status', status)), time.time() - start)
+
+#####################EXPOSITION#####################
+
+def formatLabels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (label, str(value).replace('\\', '\\\\').replace('"', '\\"')
+                                             .replace('\n', '\\n')) for label, value in labels)
+
+# Returns the cache and order book figures as (name, type, labels, value)
+def currentValues(orderBook):
+    values = []
+    for cache, stats in (('search', sqlitedb.searchCache.stats()), ('item', sqlitedb.itemCache.stats())):
+        labels = (('cache', cache),)
+        values.append(('auctionbase_cache_hits_total', 'counter', labels, stats['hits']))
+        values.append(('auctionbase_cache_misses_total', 'counter', labels, stats['misses']))
+        values.append(('auctionbase_cache_invalidations_total', 'counter', labels, stats['version']))
+        values.append(('auctionbase_cache_entries', 'gauge', labels, stats['size']))
+    if orderBook is not None:
+        stats = orderBook.stats()
+        for outcome in ('accepted', 'rejected', 'written', 'failed'):
+            values.append(('auctionbase_orderbook_bids_total', 'counter', (('outcome', outcome),), stats[outcome]))
+        values.append(('auctionbase_orderbook_batches_total', 'counter', (), stats['batches']))
+        values.append(('auctionbase_orderbook_pending', 'gauge', (), stats['pending']))
+        values.append(('auctionbase_orderbook_items', 'gauge', (), stats['items']))
+    return values
+
+# Returns the text of the /metrics page
+def render(orderBook = None):
+    with lock:
+        histogramValues = [(name, labels, list(histogram.counts), histogram.sum)
+                           for (name, labels), histogram in histograms.items()]
+        values = [(name, 'counter', labels, value) for (name, labels), value in counters.items()]
+    values.extend(currentValues(orderBook))
+
+    lines = []
+    described = set()
+    def describe(name, kind):
+        if name not in described:
+            described.add(name)
+            lines.append('# HELP %s %s' % (name, HELP.get(name, name)))
+            lines.append('# TYPE %s %s' % (name, kind))
+
+    for name, labels, counts, total in sorted(histogramValues):
+        describe(name, 'histogram')
+        cumulative = 0
+        for bound, count in zip(BUCKETS + ('+Inf',), counts):
+            cumulative += count
+            lines.append('%s_bucket%s %d' % (name, formatLabels(labels + (('le', bound),)), cumulative))
+        lines.append('%s_sum%s %.6f' % (name, formatLabels(labels), total))
+        lines.append('%s_count%s %d' % (name, formatLabels(labels), cumulative))
+    for name, kind, labels, value in sorted(values):
+        describe(name, kind)
+        lines.append('%s%s %s' % (name, formatLabels(labels), value))
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,309 @@
+import atexit
+import signal
+import threading
+from collections import deque
+
+import sqlitedb
+
+# In-memory order book for bids, an optional replacement for sqlitedb.placeBid
+# (see USE_ORDER_BOOK in auctionbase.py).
+#
+# Bids are checked against a small per-item record kept in memory and guarded
+# by a lock of its own, so bids on different items never wait for each other
+# or for SQLite. Accepted bids are queued and a writer thread inserts them into
+# Bids in batches, one transaction per batch, through the bid_check and
+# bid_apply triggers as usual.
+#
+# The database stays the source of truth: an item's record is read from the
+# database the first time it is bid on, all queued bids are written before the
+# current time changes (sqlitedb.beforeTimeChange) and when the process exits,
+# and records of auctions that have closed are dropped after a time change.
+# Starting again therefore rebuilds the book from the database. Bids accepted
+# less than FLUSH_INTERVAL seconds before a crash can be lost. A bid that
+# cannot be written after all drops its item's record, so that the record is
+# read again from the database, and is kept for the bidder to be told about
+# (takeFailedBids). Once close() has started, bids are turned away as
+# 'closing' so that none are queued after the last flush.
+#
+# Pages still read the database, so an accepted bid shows up on them once it
+# has been written, normally within FLUSH_INTERVAL seconds. While the order
+# book is in use, every bid has to go through it; bids placed with
+# sqlitedb.newBid are not seen by the records already in memory.
+
+# Seconds the writer waits for more bids before writing a batch, and the
+# largest number of bids written in one transaction
+FLUSH_INTERVAL = 0.05
+BATCH_SIZE = 200
+
+# Number of bids that could not be written kept for their bidders
+FAILED_BIDS_KEPT = 1000
+
+# What the order book keeps for one auction. Amounts and times are in the
+# units stored in the database.
+class ItemBook(object):
+    __slots__ = ('lock', 'ItemID', 'Name', 'Seller_UserID', 'First_Bid', 'Currently', 'Buy_Price',
+                 'Number_of_Bids', 'Started', 'Ends', 'Leader', 'LastBidTime', 'Closed')
+
+    def __init__(self, item, lastBid, closed):
+        self.lock = threading.Lock()
+        self.ItemID = item.ItemID
+        self.Name = item.Name
+        self.Seller_UserID = item.Seller_UserID
+        self.First_Bid = item.First_Bid
+        self.Currently = item.Currently
+        self.Buy_Price = item.Buy_Price
+        self.Number_of_Bids = item.Number_of_Bids
+        self.Started = item.Started
+        self.Ends = item.Ends
+        self.Leader = lastBid.UserID if lastBid else None
+        self.LastBidTime = lastBid.Time if lastBid else None
+        self.Closed = closed
+
+class OrderBook(object):
+    def __init__(self, flushInterval = FLUSH_INTERVAL, batchSize = BATCH_SIZE):
+        self.flushInterval = flushInterval
+        self.batchSize = batchSize
+        self.items = {}
+        self.itemsLock = threading.Lock()
+        self.users = set()
+        self.now = None
+        #accepted bids waiting to be written, as (ItemID, UserID, Amount, Time)
+        self.pending = deque()
+        self.pendingReady = threading.Condition()
+        self.flushLock = threading.Lock()
+        #bids in progress, and whether the current time is being changed; a time change waits
+        #for the bids in progress and holds back new ones until the clock has moved
+        self.clock = threading.Condition()
+        self.active = 0
+        self.changing = False
+        self.closed = False
+        self.counts = {'accepted': 0, 'rejected': 0, 'written': 0, 'failed': 0, 'batches': 0}
+        self.countsLock = threading.Lock()
+        #bids that could not be written, as (ItemID, UserID, Amount, Time), until their bidder is told
+        self.failed = deque(maxlen = FAILED_BIDS_KEPT)
+        self.writer = None
+
+    # starts the writer thread and makes sure queued bids are written before the
+    # clock moves and when the process exits (including on SIGTERM)
+    def start(self):
+        sqlitedb.beforeTimeChange.append(self.beforeTimeChange)
+        sqlitedb.afterTimeChange.append(self.afterTimeChange)
+        atexit.register(self.close)
+        try:
+            if signal.getsignal(signal.SIGTERM) == signal.SIG_DFL:
+                signal.signal(signal.SIGTERM, exitOnSignal)
+        except ValueError:
+            #signal handlers can only be installed from the main thread
+            pass
+        self.writer = threading.Thread(target = self.writeLoop, name = 'orderbook-writer')
+        self.writer.daemon = True
+        self.writer.start()
+        return self
+
+    # turns new bids away, waits for the bids in progress, then writes every
+    # queued bid and stops the writer thread
+    def close(self):
+        with self.clock:
+            if self.closed:
+                return
+            self.closed = True
+            self.clock.notify_all()
+            while self.active:
+                self.clock.wait()
+        with self.pendingReady:
+            self.pendingReady.notify()
+        if self.writer is not None:
+            self.writer.join()
+        self.flush()
+        if self.beforeTimeChange in sqlitedb.beforeTimeChange:
+            sqlitedb.beforeTimeChange.remove(self.beforeTimeChange)
+            sqlitedb.afterTimeChange.remove(self.afterTimeChange)
+
+    # Check a bid against the item's record and queue it if it passes. Returns
+    # (outcome, item, added) like sqlitedb.placeBid, with the item's ItemBook as
+    # item. Only one bid per item is accepted at each current time, as Bids
+    # allows; later ones come back with added set to False.
+    def placeBid(self, user_id, item_id, amount):
+        if user_id == '' or item_id == '' or amount == '':
+            return 'invalid', None, False
+        try:
+            stored = sqlitedb.moneyToDb(amount)
+        except (ValueError, OverflowError):
+            return 'invalid', None, False
+        with self.clock:
+            while self.changing and not self.closed:
+                self.clock.wait()
+            closing = self.closed
+            if not closing:
+                self.active += 1
+        if closing:
+            self.count('rejected')
+            return 'closing', None, False
+        try:
+            result = self.checkBid(user_id, item_id, stored)
+        finally:
+            with self.clock:
+                self.active -= 1
+                self.clock.notify_all()
+        self.count('accepted' if result[2] else 'rejected')
+        return result
+
+    def checkBid(self, user_id, item_id, stored):
+        now = self.currentTime()
+        if not self.userExists(user_id):
+            return 'noUser', None, False
+        item = self.itemBook(item_id)
+        if item is None:
+            return 'noItem', None, False
+        with item.lock:
+            if user_id == item.Seller_UserID:
+                return 'seller', item, False
+            elif stored < 0:
+                return 'negative', item, False
+            elif stored <= item.First_Bid or stored <= item.Currently:
+                return 'tooSmall', item, False
+            elif now < item.Started:
+                return 'notStarted', item, False
+            elif now >= item.Ends or item.Closed:
+                return 'ended', item, False
+            outcome = 'purchase' if item.Buy_Price is not None and stored >= item.Buy_Price else 'bid'
+            if item.LastBidTime == now:
+                return outcome, item, False
+            item.Currently = stored
+            item.Number_of_Bids += 1
+            item.Leader = user_id
+            item.LastBidTime = now
+            item.Closed = outcome == 'purchase'
+            self.pending.append((item.ItemID, user_id, stored, now))
+        if len(self.pending) >= self.batchSize:
+            with self.pendingReady:
+                self.pendingReady.notify()
+        return outcome, item, True
+
+    def currentTime(self):
+        if self.now is None:
+            self.now = sqlitedb.getTime()
+        return self.now
+
+    def userExists(self, user_id):
+        if user_id not in self.users:
+            if sqlitedb.getUserById(user_id) is None:
+                return False
+            self.users.add(user_id)
+        return True
+
+    # returns the record of an item, reading it from the database the first time
+    def itemBook(self, item_id):
+        key = sqlitedb.itemCacheKey(item_id)
+        item = self.items.get(key)
+        if item is not None:
+            return item
+        with self.itemsLock:
+            item = self.items.get(key)
+            if item is None:
+                row = sqlitedb.getItemById(item_id)
+                if row is None:
+                    return None
+                lastBid = sqlitedb.query('select UserID, Time from Bids where ItemID = $itemID order by Time desc limit 1',
+                                         {'itemID': row.ItemID})
+                item = ItemBook(row, lastBid[0] if lastBid else None, sqlitedb.getStatusById(row.ItemID) == 'close')
+                self.items[key] = item
+        return item
+
+    def writeLoop(self):
+        while not self.closed:
+            with self.pendingReady:
+                if len(self.pending) < self.batchSize and not self.closed:
+                    self.pendingReady.wait(self.flushInterval)
+            self.flush()
+
+    # writes every queued bid, in batches of at most batchSize
+    def flush(self):
+        with self.flushLock:
+            while self.pending:
+                batch = []
+                while self.pending and len(batch) < self.batchSize:
+                    batch.append(self.pending.popleft())
+                self.writeBatch(batch)
+
+    # Inserts a batch of bids in one transaction. If the triggers reject any of
+    # them, the batch is written again one bid at a time so that only the
+    # rejected bids are lost; the records of their items no longer match the
+    # database and are dropped.
+    def writeBatch(self, batch):
+        t = sqlitedb.transaction()
+        try:
+            sqlitedb.preparedMany(sqlitedb.INSERT_BID, batch)
+        except Exception:
+            t.rollback()
+            for bid in batch:
+                t = sqlitedb.transaction()
+                try:
+                    sqlitedb.preparedQuery(sqlitedb.INSERT_BID, bid)
+                except Exception as bidExc:
+                    t.rollback()
+                    self.count('failed')
+                    print('Order book could not write bid %s: %s' % (bid, bidExc))
+                    self.forgetItem(bid[0])
+                    with self.countsLock:
+                        self.failed.append(bid)
+                else:
+                    t.commit()
+                    self.count('written')
+        else:
+            t.commit()
+            self.count('written', len(batch))
+        self.count('batches')
+        sqlitedb.searchCache.invalidate()
+        for itemID in set(bid[0] for bid in batch):
+            sqlitedb.itemCache.invalidate(itemID)
+
+    # drops the record of an item, which is read again from the database when it is next bid on
+    def forgetItem(self, item_id):
+        with self.itemsLock:
+            self.items.pop(sqlitedb.itemCacheKey(item_id), None)
+
+    # returns the bids of a user that were accepted but could not be written, as
+    # (ItemID, UserID, Amount, Time), and forgets them
+    def takeFailedBids(self, user_id):
+        with self.countsLock:
+            mine = [bid for bid in self.failed if bid[1] == user_id]
+            if mine:
+                others = [bid for bid in self.failed if bid[1] != user_id]
+                self.failed.clear()
+                self.failed.extend(others)
+        return mine
+
+    def beforeTimeChange(self):
+        with self.clock:
+            self.changing = True
+            while self.active:
+                self.clock.wait()
+        self.flush()
+
+    # reads the new current time and drops the records of auctions that have closed
+    def afterTimeChange(self):
+        self.now = sqlitedb.getTime()
+        with self.itemsLock:
+            for key, item in list(self.items.items()):
+                if item.Closed or item.Ends < self.now:
+                    del self.items[key]
+        with self.clock:
+            self.changing = False
+            self.clock.notify_all()
+
+    def count(self, name, n = 1):
+        with self.countsLock:
+            self.counts[name] += n
+
+    # returns the bid counts, the number of queued bids and the number of items in memory
+    def stats(self):
+        with self.countsLock:
+            stats = dict(self.counts)
+        stats['pending'] = len(self.pending)
+        stats['items'] = len(self.items)
+        return stats
+
+# SIGTERM handler that exits through SystemExit, so that atexit writes the queued bids
+def exitOnSignal(signum, frame):
+    raise SystemExit(128 + signum)
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+
+# Checks that sqlitedb.searchAuction and searchPage queries are answered from
+# indexes.
+#
+# Runs EXPLAIN QUERY PLAN on the query built for every status combined with
+# each search parameter, using values taken from AuctionBase.db: unpaged, and
+# as a page in every sqlitedb.SEARCH_ORDERS order, both the first page and a
+# later one that starts after a cursor. It fails if
+#  - a plan scans the whole Items, Categories or ItemStatus table, other than
+#    a page read in order from the sort key's own index,
+#  - a page has to sort every match (USE TEMP B-TREE FOR ORDER BY) when only
+#    the status or one price bound limits them, or
+#  - a later page read in order does not seek to the cursor.
+# Run it from this directory after loading the database (including
+# indexes.sql and status_add.sql):
+#
+#   python search_plan_verify.py
+
+import sys; sys.path.insert(0, 'lib')
+
+import sqlitedb
+
+STATUSES = ['open', 'close', 'notStarted', 'all']
+PARAMETERS = ['userID', 'itemID', 'category', 'description', 'minPrice', 'maxPrice']
+ORDERS = sorted(sqlitedb.SEARCH_ORDERS)
+
+# Parameters that limit the matches enough for a page to sort them; a price
+# range does as well when both of its bounds are given
+SELECTIVE = ['userID', 'itemID', 'category', 'description']
+
+# How each order's cursor appears in a plan that seeks to it (relevance needs
+# keywords, which are selective)
+CURSOR_SEEKS = {'itemID': 'rowid>?', 'ends': 'Ends>?', 'price': '<expr>>?'}
+
+# Returns sample values for each search parameter, taken from an item that is
+# in the database, and a cursor for each order that starts after that item
+def sampleValues():
+    item = sqlitedb.query('select *, IFNULL(Currently, First_Bid) as Price from Items limit 1')[0]
+    category = sqlitedb.query('select Category from Categories where ItemID = $itemID', {'itemID': item.ItemID})[0]
+    samples = {
+        'userID': item.Seller_UserID,
+        'itemID': str(item.ItemID),
+        'category': category.Category,
+        'description': item.Name.split()[0] if item.Name.split() else 'the',
+        'minPrice': '10',
+        'maxPrice': '20',
+    }
+    cursors = {
+        'itemID': (item.ItemID, item.ItemID),
+        'ends': (item.Ends, item.ItemID),
+        'price': (item.Price, item.ItemID),
+        'relevance': (-1.0, item.ItemID),
+    }
+    return samples, cursors
+
+# Returns the plan lines that read a whole table. Scans of an index (USING
+# INDEX), lookups (SEARCH) and full-text queries (VIRTUAL TABLE) are fine, and
+# so is walking Items by ItemID for a page in that order, which stops at the
+# page's limit.
+def fullScans(plan, inItemIDOrder = False):
+    return [line for line in plan if line.startswith('SCAN') and 'USING' not in line and
+            'VIRTUAL TABLE' not in line and ('Items' in line or 'Categories' in line or 'ItemStatus' in line) and
+            not (inItemIDOrder and line == 'SCAN Items')]
+
+# Returns the problems with a plan, as described at the top of this file
+def planProblems(plan, params, order, after):
+    if order == 'relevance' and not params.get('description'):
+        order = 'itemID'
+    sorts = 'USE TEMP B-TREE FOR ORDER BY' in plan
+    problems = fullScans(plan, order == 'itemID' and not sorts)
+    if order is None or any(params.get(parameter) for parameter in SELECTIVE) or \
+            (params.get('minPrice') and params.get('maxPrice')):
+        return problems
+    if sorts:
+        problems.append('sorts every match')
+    elif after is not None and not any(CURSOR_SEEKS[order] in line for line in plan):
+        problems.append('does not seek to the cursor')
+    return problems
+
+def explain(params, status, order = None, after = None):
+    query_string, vars = sqlitedb.buildSearchQuery(params.get('userID'), params.get('itemID'), params.get('category'),
+                                                   params.get('description'), params.get('minPrice'),
+                                                   params.get('maxPrice'), status, order, after,
+                                                   sqlitedb.SEARCH_PAGE_SIZE + 1)
+    return [row.detail for row in sqlitedb.query('EXPLAIN QUERY PLAN ' + query_string, vars)]
+
+def main():
+    samples, cursors = sampleValues()
+    searches = []
+    for status in STATUSES:
+        for parameter in PARAMETERS:
+            searches.append((status, {parameter: samples[parameter]}))
+        searches.append((status, {'description': samples['description'], 'category': samples['category']}))
+        searches.append((status, {'minPrice': samples['minPrice'], 'maxPrice': samples['maxPrice']}))
+    cases = []
+    for status, params in searches:
+        cases.append((status, params, None, None))
+        for order in ORDERS:
+            cases.append((status, params, order, None))
+            cases.append((status, params, order, cursors[order]))
+
+    failures = 0
+    for status, params, order, after in cases:
+        plan = explain(params, status, order, after)
+        problems = planProblems(plan, params, order, after)
+        print('%-4s %-10s %-9s %-6s %s' % ('FAIL' if problems else 'ok', status, order or '-',
+                                          'cursor' if after is not None else '', ', '.join(sorted(params))))
+        if problems:
+            failures += 1
+            for line in plan:
+                print('       ' + line)
+            for problem in problems:
+                print('       -> ' + problem)
+    print('%d of %d search plans use indexes' % (len(cases) - failures, len(cases)))
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sqlitedb.db.printing = False
+    sys.exit(main())
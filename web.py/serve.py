@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+
+# Production server for auctionbase.py.
+#
+# app.run() at the bottom of auctionbase.py starts web.py's development
+# server, which reloads changed modules, prints every query and logs every
+# request. This serves the same application without any of that, from a WSGI
+# server with a fixed pool of worker threads, optionally in several processes.
+# Run it from the directory that holds AuctionBase.db:
+#
+#   python serve.py [--port 8080] [--threads 16] [--processes 1]
+#                   [--backlog 128] [--queue 64] [--queue-timeout 5]
+#                   [--metrics | --no-metrics]
+#
+# Each worker thread has its own database connection. Connections the server
+# has accepted wait for a free worker in a queue of at most --queue
+# connections; while that queue is full, new connections wait in the socket's
+# listen backlog of --backlog. A connection that cannot be queued within
+# --queue-timeout seconds is answered with 503 Service Unavailable, so an
+# overloaded server turns requests away instead of letting waits grow.
+#
+# With --processes N, N copies of the server share the port (SO_REUSEPORT),
+# so rendering pages is not limited to one core by the interpreter lock. Each
+# process keeps its own caches and drops them when another process changes
+# the database (sqlitedb.dropStaleCaches). The in-memory order book
+# (USE_ORDER_BOOK in auctionbase.py) only works in a single process.
+#
+# With --metrics, requests and queries are timed for the /metrics page (see
+# metrics.py); without --metrics or --no-metrics, USE_METRICS in
+# auctionbase.py decides. With several processes, each process answers
+# /metrics with its own figures.
+
+import sys; sys.path.insert(0, 'lib')
+
+import argparse
+import errno
+import os
+import signal
+
+import web
+import sqlitedb
+import auctionbase
+import metrics
+
+try:
+    from cheroot import wsgi
+except ImportError:
+    #web.py before 0.40 comes with CherryPy's server instead
+    wsgi = None
+
+# Returns the WSGI function for auctionbase's pages, without the debugging
+# aids of the development server
+def makeApp(options):
+    web.config.debug = False
+    sqlitedb.db.printing = False
+    app = web.application(auctionbase.urls, vars(auctionbase), autoreload = False)
+    app.add_processor(web.loadhook(sqlitedb.enforceForeignKey))
+    if options.processes > 1:
+        app.add_processor(web.loadhook(sqlitedb.dropStaleCaches))
+    if metrics.isEnabled():
+        app.add_processor(metrics.requestTimer(auctionbase.urls[::2]))
+    return app.wsgifunc()
+
+def makeServer(app, options):
+    address = (options.host, options.port)
+    if wsgi is None:
+        #CherryPy's server takes as many accepted connections as arrive
+        from web.wsgiserver import CherryPyWSGIServer
+        return CherryPyWSGIServer(address, app, numthreads = options.threads, max = options.threads,
+                                  request_queue_size = options.backlog, server_name = 'localhost')
+    server = wsgi.Server(address, app, numthreads = options.threads, max = options.threads,
+                         request_queue_size = options.backlog, accepted_queue_size = options.queue,
+                         accepted_queue_timeout = options.queueTimeout, server_name = 'localhost')
+    server.reuse_port = options.processes > 1
+    return server
+
+# Runs one server until it is interrupted or sent SIGTERM
+def serve(options):
+    if signal.getsignal(signal.SIGTERM) == signal.SIG_DFL:
+        signal.signal(signal.SIGTERM, exitOnSignal)
+    server = makeServer(makeApp(options), options)
+    try:
+        server.start()
+    except (KeyboardInterrupt, SystemExit):
+        server.stop()
+
+def exitOnSignal(signum, frame):
+    raise SystemExit(128 + signum)
+
+# Starts a server in each of the given number of child processes and waits
+# for them, passing SIGTERM and SIGINT on
+def serveProcesses(options):
+    children = []
+    for i in range(options.processes):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                serve(options)
+            finally:
+                os._exit(0)
+        children.append(pid)
+
+    def stopChildren(signum, frame):
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+    signal.signal(signal.SIGTERM, stopChildren)
+    signal.signal(signal.SIGINT, stopChildren)
+    for pid in children:
+        while True:
+            try:
+                os.waitpid(pid, 0)
+                break
+            except OSError as waitExc:
+                if waitExc.errno != errno.EINTR:
+                    raise
+
+def main(argv):
+    argParser = argparse.ArgumentParser(description = 'Serve AuctionBase from a multi-threaded WSGI server.')
+    argParser.add_argument('--host', default = '0.0.0.0', help = 'address to listen on')
+    argParser.add_argument('--port', type = int, default = 8080, help = 'port to listen on')
+    argParser.add_argument('--threads', type = int, default = 16, help = 'worker threads per process')
+    argParser.add_argument('--processes', type = int, default = 1, help = 'server processes sharing the port')
+    argParser.add_argument('--backlog', type = int, default = 128, help = 'listen backlog of the socket')
+    argParser.add_argument('--queue', type = int, default = 64,
+                           help = 'accepted connections waiting for a worker thread')
+    argParser.add_argument('--queue-timeout', dest = 'queueTimeout', type = float, default = 5,
+                           help = 'seconds to wait for room in the queue before answering 503')
+    argParser.add_argument('--metrics', dest = 'metrics', action = 'store_true', default = auctionbase.USE_METRICS,
+                           help = 'time requests and queries for /metrics')
+    argParser.add_argument('--no-metrics', dest = 'metrics', action = 'store_false',
+                           help = 'do not time requests and queries for /metrics')
+    options = argParser.parse_args(argv[1:])
+    if options.threads < 1 or options.processes < 1 or options.queue < 1:
+        argParser.error('--threads, --processes and --queue must be at least 1')
+    if options.processes > 1 and auctionbase.USE_ORDER_BOOK:
+        argParser.error('the order book only works with --processes 1')
+    if options.processes > 1 and wsgi is None:
+        argParser.error('--processes needs the cheroot server of web.py 0.40 or later')
+
+    if options.metrics:
+        metrics.enable()
+    else:
+        metrics.disable()
+    auctionbase.load_templates()
+    print('http://%s:%d/ (%d processes of %d threads)' % (options.host, options.port, options.processes, options.threads))
+    if options.processes == 1:
+        serve(options)
+    else:
+        serveProcesses(options)
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -1,13 +1,82 @@
 import web
+import base64
+import json
+import math
+import re
+import threading
+import time
+from calendar import timegm
+from collections import OrderedDict
 
-db = web.database(dbn='sqlite', db = 'AuctionBase.db')
+# Settings applied to every new connection. WAL journaling lets pages keep
+# reading while a bid or time change commits, and with WAL synchronous=NORMAL
+# only syncs at checkpoints; a power loss (not a crash) can lose the last
+# commits.
+CONNECTION_PRAGMAS = [
+    'PRAGMA foreign_keys = ON',
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA cache_size = -16000',
+    'PRAGMA mmap_size = 268435456',
+    'PRAGMA busy_timeout = 5000',
+]
+
+# Number of prepared statements each connection keeps compiled
+CACHED_STATEMENTS = 256
+
+# Called as statementTimer(query_string, params, seconds, error) after every
+# statement while metrics are on (see metrics.py); None turns timing off.
+statementTimer = None
+
+# web.py already gives each thread its own sqlite connection, opened on the
+# thread's first query. This sets every connection up once, when it is opened,
+# instead of running PRAGMAs on every request.
+class AuctionBaseDB(web.db.SqliteDB):
+    def _connect(self, keywords):
+        connection = web.db.SqliteDB._connect(self, keywords)
+        for pragma in CONNECTION_PRAGMAS:
+            connection.execute(pragma)
+        return connection
+
+    # every statement run through web.py (query, iterQuery, update and the
+    # transactions) passes through here; for a select this times the statement
+    # up to its first row
+    def _db_execute(self, cur, sql_query):
+        if statementTimer is None:
+            return web.db.SqliteDB._db_execute(self, cur, sql_query)
+        return timeStatement(lambda query_string, params: web.db.SqliteDB._db_execute(self, cur, query_string),
+                             sql_query, None)
+
+db = AuctionBaseDB(db = 'AuctionBase.db', cached_statements = CACHED_STATEMENTS)
+
+# Databases built from create_compact.sql set this user_version and store times
+# as integer seconds since the epoch and amounts as integer cents
+COMPACT_SCHEMA_VERSION = 1
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Default and largest number of search results on one page
+SEARCH_PAGE_SIZE = 50
+MAX_SEARCH_PAGE_SIZE = 500
+
+# Number of categories listed with their item counts next to search results
+FACET_LIMIT = 20
+
+# Number of search results kept by the search cache (0 turns it off)
+SEARCH_CACHE_SIZE = 256
+
+# Number of item snapshots kept by the item cache (0 turns it off) and the
+# number of seconds each one is kept for
+ITEM_CACHE_SIZE = 1024
+ITEM_CACHE_TTL = 2
 
 ######################BEGIN HELPER METHODS######################
 
 # Enforce foreign key constraints
 # WARNING: DO NOT REMOVE THIS!
+# Connections are opened with foreign keys on (see CONNECTION_PRAGMAS), so
+# this only opens the current thread's connection if it has none yet.
 def enforceForeignKey():
-    db.query('PRAGMA foreign_keys = ON')
+    db.ctx.db
 
 # initiates a transaction on the database
 def transaction():
@@ -26,11 +95,67 @@ def transaction():
 #
 # check out http://webpy.org/cookbook/transactions for examples
 
+# Runs a statement with ? parameters directly on the current thread's
+# connection and returns the rows like query does. The connection keeps the
+# compiled statement in its statement cache, so the hot queries that use this
+# are parsed once per connection instead of being rebuilt from $variables by
+# web.py and parsed again on every call.
+def preparedQuery(query_string, params = ()):
+    if statementTimer is None:
+        return runPrepared(query_string, params)
+    return timeStatement(runPrepared, query_string, params)
+
+def runPrepared(query_string, params):
+    cursor = db.ctx.db.cursor()
+    try:
+        cursor.execute(query_string, params)
+        if cursor.description is None:
+            return []
+        names = [column[0] for column in cursor.description]
+        return [web.Storage(zip(names, row)) for row in cursor]
+    finally:
+        cursor.close()
+
+# like preparedQuery, but runs the statement once for each tuple of parameters
+def preparedMany(query_string, params):
+    if statementTimer is None:
+        return runPreparedMany(query_string, params)
+    return timeStatement(runPreparedMany, query_string, params)
+
+def runPreparedMany(query_string, params):
+    db.ctx.db.executemany(query_string, params)
+
+# runs run(query_string, params) and reports how long it took to statementTimer
+def timeStatement(run, query_string, params):
+    start = time.time()
+    try:
+        result = run(query_string, params)
+    except Exception as statementExc:
+        statementTimer(query_string, params, time.time() - start, statementExc)
+        raise
+    statementTimer(query_string, params, time.time() - start, None)
+    return result
+
+# Returns the lines of EXPLAIN QUERY PLAN for a statement, given as passed to
+# statementTimer: a web.py query, or a statement with ? parameters and its
+# parameters (or a list of them, of which the first is used)
+def explainStatement(query_string, params = ()):
+    if isinstance(query_string, web.db.SQLQuery):
+        query_string, params = db._process_query(query_string)
+    elif isinstance(params, list):
+        params = params[0] if params else ()
+    cursor = db.ctx.db.cursor()
+    try:
+        cursor.execute('EXPLAIN QUERY PLAN ' + query_string, params)
+        return [row[-1] for row in cursor]
+    finally:
+        cursor.close()
+
 # returns the current time from your database
 def getTime():
     #should be the correct column names
     query_string = 'select Time from CurrentTime'
-    results = query(query_string)
+    results = preparedQuery(query_string)
     return results[0].Time
 
 # returns a single item specified by the Item's ID in the database
@@ -38,62 +163,301 @@ def getTime():
 # a given ID), this will throw an Exception!
 def getItemById(item_id):
     # Catch the Exception in case `result' is empty
-    query_string = 'select * from Items where ItemID = $itemID'
-    result = query(query_string, {'itemID': item_id})
+    query_string = 'select * from Items where ItemID = ?'
+    result = preparedQuery(query_string, (item_id,))
     try:
         return result[0]
     except IndexError:
         return None
 
+# returns True if the database uses the compact schema. The answer is read
+# from PRAGMA user_version the first time and cached afterwards.
+compactSchema = None
+def isCompact():
+    global compactSchema
+    if compactSchema is None:
+        compactSchema = query('PRAGMA user_version')[0].user_version == COMPACT_SCHEMA_VERSION
+    return compactSchema
+
+# Conversions between the 'YYYY-MM-DD HH:MM:SS' times and dollar amounts used by
+# the web pages and the values stored in the database. Values read from either
+# schema compare correctly with each other, so comparisons never need these;
+# they are only used on user input and when a value is displayed.
+def timeToDb(time_str):
+    if isCompact():
+        return timegm(time.strptime(time_str, TIME_FORMAT))
+    return time_str
+
+def timeFromDb(value):
+    if isCompact() and value is not None:
+        return time.strftime(TIME_FORMAT, time.gmtime(value))
+    return value
+
+#amounts that are not finite numbers (inf, nan) raise ValueError
+def moneyToDb(amount):
+    value = float(amount)
+    if math.isinf(value) or math.isnan(value):
+        raise ValueError('Amount is not a finite number: %r' % (amount,))
+    if isCompact():
+        return int(round(value * 100))
+    return value
+
+def moneyFromDb(value):
+    if isCompact() and value is not None:
+        return '%d.%02d' % divmod(value, 100)
+    return value
+
+# SQL expressions that format a stored time or amount column for display
+def timeColumn(column):
+    if isCompact():
+        return "strftime('%%Y-%%m-%%d %%H:%%M:%%S', %s, 'unixepoch')" % column
+    return column
+
+def moneyColumn(column):
+    if isCompact():
+        return "(CASE WHEN %s IS NULL THEN NULL ELSE printf('%%.2f', %s / 100.0) END)" % (column, column)
+    return column
+
 # wrapper method around web.py's db.query method
 # check out http://webpy.org/cookbook/query for more info
 def query(query_string, vars = {}):
     return list(db.query(query_string, vars))
 
+# like query, but returns the rows as an iterator that fetches them from the
+# database one at a time instead of building a list first
+def iterQuery(query_string, vars = {}):
+    return db.query(query_string, vars)
+
+# Least recently used cache of query results with an optional time to live in
+# seconds. invalidate() drops one key or every entry; the version counter keeps
+# a result that was being computed during the invalidation from being stored
+# afterwards. Changes made to the database by other processes are only noticed
+# through dropStaleCaches.
+class ResultCache(object):
+    def __init__(self, size, ttl = None):
+        self.size = size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    # returns the cached result for key, or None
+    def get(self, key):
+        with self.lock:
+            try:
+                expires, value = self.entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return None
+            if expires is not None and expires < time.time():
+                self.misses += 1
+                return None
+            self.entries[key] = (expires, value)
+            self.hits += 1
+            return value
+
+    # stores a result computed while the cache was at the given version
+    def put(self, key, version, value):
+        with self.lock:
+            if version != self.version or self.size <= 0:
+                return
+            self.entries.pop(key, None)
+            self.entries[key] = (time.time() + self.ttl if self.ttl else None, value)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last = False)
+
+    def invalidate(self, key = None):
+        with self.lock:
+            self.version += 1
+            if key is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(key, None)
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self.entries), 'version': self.version}
+
+# Drops every cached result if the database has been changed through another
+# connection since the current thread's connection last checked. Changes made
+# in this process already invalidate the caches where they are made; this is
+# for servers that run several processes on one database (see serve.py). The
+# caches are shared by all threads, so a connection's first check also drops
+# them: results cached by other threads may predate changes this connection
+# has no earlier version to compare with.
+def dropStaleCaches():
+    version = preparedQuery('PRAGMA data_version')[0].data_version
+    seen = db.ctx.get('dataVersion')
+    db.ctx.dataVersion = version
+    if seen != version:
+        searchCache.invalidate()
+        itemCache.invalidate()
+
 #####################END HELPER METHODS#####################
 
 #additional methods:
 
 #update the current time of AuctionBase (should conform to specified time constraints)
 def updateTime(curr_time):
+    for hook in beforeTimeChange:
+        hook()
     #transaction() sample code provided from above
     t = transaction()
     try:
-        db.update('CurrentTime', where = 'Time = $cTime', vars = {'cTime': getTime()}, Time = curr_time)
+        db.update('CurrentTime', where = 'Time = $cTime', vars = {'cTime': getTime()}, Time = timeToDb(curr_time))
     except Exception as timeExc:
         #if there was an error in updating the time, avoid making changes, and elevate the error to auctionbase.py
         t.rollback()
         raise Exception
     else:
         t.commit()
+        searchCache.invalidate()
+        itemCache.invalidate()
+    finally:
+        for hook in afterTimeChange:
+            hook()
 
-#make a new bid on an item
-def newBid(curr_user, curr_item, curr_amount):
+#Functions called before and after every change of the current time (whether or not it succeeds).
+#orderbook.py uses them to write out the bids accepted at the old time before the clock moves.
+beforeTimeChange = []
+afterTimeChange = []
+
+INSERT_BID = 'insert into Bids (ItemID, UserID, Amount, Time) values (?, ?, ?, ?)'
+
+#make a new bid on an item, at bid_time if given and otherwise at the current time
+def newBid(curr_user, curr_item, curr_amount, bid_time = None):
+    if bid_time is None:
+        bid_time = getTime()
     t = transaction()
     try:
-        db.insert('Bids', userID = curr_user, itemID = curr_item, Amount = curr_amount, Time = getTime())
+        preparedQuery(INSERT_BID, (curr_item, curr_user, moneyToDb(curr_amount), bid_time))
     except Exception as bidExc:
         #if there was an error in bidding, avoid making changes and indicate that a bid was not made
         t.rollback()
         return False
     else:
         t.commit()
+        searchCache.invalidate()
+        itemCache.invalidate(itemCacheKey(curr_item))
         return True
 
+#Everything the item page shows about an item, read with a single statement so that every part
+#comes from the same state of the database: the Items row, its stored status, its categories, the
+#current time, its settlement if it has closed and its bids in the order they were placed (as a
+#JSON array, decoded by getItemSnapshot).
+ITEM_SNAPSHOT_QUERY = """select Items.*, ItemStatus.Status, CurrentTime.Time as CurrentTime,
+    (select group_concat(Category, ', ') from Categories where Categories.ItemID = Items.ItemID) as Category,
+    Settlements.Winner_UserID as Winner, Settlements.Closed as Closed,
+    (select json_group_array(json_array(UserID, Time, Amount)) from
+        (select UserID, Time, Amount from Bids where Bids.ItemID = Items.ItemID order by Time)) as BidHistory
+    from Items join ItemStatus on ItemStatus.ItemID = Items.ItemID
+    join CurrentTime
+    left join Settlements on Settlements.ItemID = Items.ItemID
+    where Items.ItemID = ?"""
+
+#Snapshots are cached for ITEM_CACHE_TTL seconds; bids invalidate the snapshot of their item and
+#time changes invalidate all of them
+itemCache = ResultCache(ITEM_CACHE_SIZE, ITEM_CACHE_TTL)
+
+#Item IDs typed as '123' and '0123' name the same item
+def itemCacheKey(item_id):
+    try:
+        return int(item_id)
+    except (TypeError, ValueError):
+        return item_id
+
+#returns a snapshot of an item, or None if there is no such item. The snapshot is the Items row
+#plus Status, Category, CurrentTime, Winner and Closed as described above, Bids (the bid history
+#with the columns of getBidById) and Leader (the winner of a closed auction, otherwise the highest
+#bidder, or None without bids). With cached set, a recent snapshot may be returned from itemCache.
+def getItemSnapshot(item_id, cached = True):
+    key = itemCacheKey(item_id)
+    if cached:
+        snapshot = itemCache.get(key)
+        if snapshot is not None:
+            return snapshot
+    version = itemCache.version
+    result = preparedQuery(ITEM_SNAPSHOT_QUERY, (item_id,))
+    if not result:
+        return None
+    snapshot = result[0]
+    history = json.loads(snapshot.pop('BidHistory'))
+    snapshot.Bids = [web.Storage([('User ID', userID), ('Bid Time', timeFromDb(bidTime)), ('Bid Price', moneyFromDb(amount))])
+                     for userID, bidTime, amount in history]
+    if snapshot.Winner is not None or snapshot.Closed is not None:
+        snapshot.Leader = snapshot.Winner
+    elif history:
+        snapshot.Leader = max(history, key = lambda bid: bid[2])[0]
+    else:
+        snapshot.Leader = None
+    if cached:
+        itemCache.put(key, version, snapshot)
+    return snapshot
+
+#Everything placeBid checks a bid against, read with one statement: the current time, whether the
+#bidder exists and the item with its stored status. Without such an item the Items columns are null.
+BID_CHECK_QUERY = """select CurrentTime.Time as CurrentTime,
+    exists (select 1 from Users where UserID = ?) as UserExists,
+    Items.ItemID, Items.Name, Items.Seller_UserID, Items.First_Bid, Items.Currently, Items.Buy_Price,
+    Items.Started, Items.Ends, ItemStatus.Status
+    from CurrentTime
+    left join Items on Items.ItemID = ?
+    left join ItemStatus on ItemStatus.ItemID = Items.ItemID"""
+
+#Check a bid and place it if it passes. Returns (outcome, item, added): outcome is 'bid' or
+#'purchase' (the amount reaches the buy price and closes the auction) for bids that were attempted,
+#otherwise the reason the bid was rejected: 'invalid' (missing value or an amount that is not a finite
+#number), 'noUser', 'noItem', 'seller', 'negative', 'tooSmall', 'notStarted' or 'ended'. item is
+#the item's row from BID_CHECK_QUERY, or None; added tells whether the bid was inserted, which can
+#still fail on the bid triggers if another bid got in first.
+def placeBid(user_id, item_id, amount):
+    if user_id == '' or item_id == '' or amount == '':
+        return 'invalid', None, False
+    try:
+        stored = moneyToDb(amount)
+    except (ValueError, OverflowError):
+        return 'invalid', None, False
+    check = preparedQuery(BID_CHECK_QUERY, (user_id, item_id))[0]
+    item = check if check.ItemID is not None else None
+    if not check.UserExists:
+        return 'noUser', item, False
+    elif item is None:
+        return 'noItem', None, False
+    elif user_id == item.Seller_UserID:
+        return 'seller', item, False
+    elif stored < 0:
+        return 'negative', item, False
+    elif stored <= item.First_Bid or stored <= item.Currently:
+        return 'tooSmall', item, False
+    elif check.CurrentTime < item.Started:
+        return 'notStarted', item, False
+    #an auction that reached its buy price is closed as well
+    elif check.CurrentTime >= item.Ends or item.Status == 'close':
+        return 'ended', item, False
+    outcome = 'purchase' if item.Buy_Price is not None and stored >= item.Buy_Price else 'bid'
+    return outcome, item, newBid(user_id, item_id, amount, check.CurrentTime)
+
 #retrieve bid records on a specific item
 def getBidById(item_id):
     #Get the userID, bid time, and bid price for the specified item
-    query_string = 'select UserID as "User ID", Time as "Bid Time", Amount as "Bid Price" from Bids where ItemID = $itemID'
+    query_string = 'select UserID as "User ID", %s as "Bid Time", %s as "Bid Price" from Bids where ItemID = $itemID' % (timeColumn('Time'), moneyColumn('Amount'))
     result = query(query_string, {'itemID': item_id})
     try:
         return result
     except IndexError:
         return None
 
+#like getBidById, but in bid time order and read from the database one bid at a time
+def iterBidsById(item_id):
+    query_string = 'select UserID as "User ID", %s as "Bid Time", %s as "Bid Price" from Bids where ItemID = $itemID order by Time' % (timeColumn('Time'), moneyColumn('Amount'))
+    return iterQuery(query_string, {'itemID': item_id})
+
 #retrieve a user by its specified userID. Can be used to check if a user exists.
 def getUserById(user_id):
-    query_string = 'select * from Users where UserID = $userID'
-    result = query(query_string, {'userID': user_id})
+    query_string = 'select * from Users where UserID = ?'
+    result = preparedQuery(query_string, (user_id,))
     try:
         return result[0]
     except IndexError:
@@ -108,6 +472,40 @@ def getWinnerById(item_id):
     except IndexError:
         return None
 
+#Settlements of closed auctions (see settlement_add.sql), with the item name and the final price
+#and close time formatted for display
+SETTLEMENT_COLUMNS = 'Settlements.ItemID, Items.Name, Settlements.Winner_UserID, %s as Price, %s as Closed'
+
+#retrieve the settlement of a closed auction, or None if the auction has not closed
+def getSettlementById(item_id):
+    query_string = ('select ' + SETTLEMENT_COLUMNS + ' from Settlements join Items on Items.ItemID = Settlements.ItemID where Settlements.ItemID = $itemID') % (moneyColumn('Settlements.Price'), timeColumn('Settlements.Closed'))
+    result = query(query_string, {'itemID': item_id})
+    try:
+        return result[0]
+    except IndexError:
+        return None
+
+#list the auctions that closed from `since' up to (not including) `until', in the order they closed.
+#Both times are optional and given as 'YYYY-MM-DD HH:MM:SS'.
+def getClosedAuctions(since = None, until = None, limit = SEARCH_PAGE_SIZE):
+    where = []
+    vars = {'limit': limit}
+    if since:
+        where.append('Settlements.Closed >= $since')
+        vars['since'] = timeToDb(since)
+    if until:
+        where.append('Settlements.Closed < $until')
+        vars['until'] = timeToDb(until)
+    query_string = ('select ' + SETTLEMENT_COLUMNS + ' from Settlements join Items on Items.ItemID = Settlements.ItemID') % (moneyColumn('Settlements.Price'), timeColumn('Settlements.Closed'))
+    if where:
+        query_string += ' where ' + ' AND '.join(where)
+    return query(query_string + ' order by Settlements.Closed, Settlements.ItemID limit $limit', vars)
+
+#list the auctions won by a user, most recently closed first
+def getWinsByUser(user_id):
+    query_string = ('select ' + SETTLEMENT_COLUMNS + ' from Settlements join Items on Items.ItemID = Settlements.ItemID where Settlements.Winner_UserID = $userID order by Settlements.Closed desc') % (moneyColumn('Settlements.Price'), timeColumn('Settlements.Closed'))
+    return query(query_string, {'userID': user_id})
+
 #Get the categories for an item
 def getCategoryById(item_id):
     query_string = 'select group_concat(Category,", ") as Category from Categories where ItemID = $itemID'
@@ -117,41 +515,249 @@ def getCategoryById(item_id):
     except IndexError:
         return None
 
-#Search through the database to retrieve all details of corresponding auctions based on parameters
-def searchAuction(userID, itemID, category, description, minPrice, maxPrice, status):
-    #Disregard parameters that have not been specified
-    if description is None:
-        description = '%%'
-    else:
-        description = '%' + description + '%'
-    if minPrice == '':
-        minPrice = 0
-    else:
-        minPrice = float(minPrice)
-    if maxPrice == '':
-        maxPrice = 99999999999999999
-    else:
-        maxPrice = float(maxPrice)
-
-    #All four statuses have a similar structure: Retrieve auctions that correspond to the specified
-    #parameters such as category, itemID, userID, description, and prices. Grouped by itemID.
-
-    #If searching for open auctions, also ensure that the startTime is before currTime, endTime is after currTime, and buyPrice has not been exceeded.
-    if status == 'open':
-        query_string = 'select Items.ItemID, Items.Name, Categories.category as Categories, Items.Started as "Start Time", Items.Ends as "End Time", CurrentTime.Time as "Current Time", Items.First_Bid as "First Bid", Items.Currently as "Current Price", Items.Number_of_Bids as "Number of Bids", Items.Buy_Price as "Buy Price", Items.Seller_UserID as "Seller ID", Items.Description, group_concat(category,", ") as Category from Items, Categories, CurrentTime where (Categories.ItemID = Items.ItemID) AND (IFNULL($category, "") = "" OR $category = Categories.category) AND (IFNULL($itemID, "") = "" OR $itemID = Items.ItemID) AND (IFNULL($userID, "") = "" OR $userID = Items.Seller_UserID) AND (Items.Description LIKE $description) AND (IFNULL(Items.Currently, Items.First_Bid) >= $minPrice) AND (IFNULL(Items.Currently, Items.First_Bid) <= $maxPrice) AND (Items.Started <= CurrentTime.Time AND Items.Ends >= CurrentTime.Time) AND (IFNULL(Items.Buy_Price, 0) > IFNULL(Items.Currently, Items.First_Bid)) group by Items.ItemID'
-    #If searching for closed auctions, also ensure that endTime is before currTime OR that buyPrice has been exceeded.
-    elif status == 'close':
-        query_string = 'select Items.ItemID, Items.Name, Categories.category as Categories, Items.Started as "Start Time", Items.Ends as "End Time", CurrentTime.Time as "Current Time", Items.First_Bid as "First Bid", Items.Currently as "Current Price", Items.Number_of_Bids as "Number of Bids", Items.Buy_Price as "Buy Price", Items.Seller_UserID as "Seller ID", Items.Description, group_concat(category,", ") as Category from Items, Categories, CurrentTime where (Categories.ItemID = Items.ItemID) AND (IFNULL($category, "") = "" OR $category = Categories.category) AND (IFNULL($itemID, "") = "" OR $itemID = Items.ItemID) AND (IFNULL($userID, "") = "" OR $userID = Items.Seller_UserID) AND (Items.Description LIKE $description) AND (IFNULL(Items.Currently, Items.First_Bid) >= $minPrice) AND (IFNULL(Items.Currently, Items.First_Bid) <= $maxPrice) AND ((Items.Ends < CurrentTime.Time) OR (IFNULL(Items.Currently, Items.First_Bid) >= IFNULL(Items.Buy_Price, 999999999999999))) group by Items.ItemID'
-    #If searching for auctions not yet started, ensure that the startTime is after currTime
-    elif status == 'notStarted':
-        query_string = 'select Items.ItemID, Items.Name, Categories.category as Categories, Items.Started as "Start Time", Items.Ends as "End Time", CurrentTime.Time as "Current Time", Items.First_Bid as "First Bid", Items.Currently as "Current Price", Items.Number_of_Bids as "Number of Bids", Items.Buy_Price as "Buy Price", Items.Seller_UserID as "Seller ID", Items.Description, group_concat(category,", ") as Category from Items, Categories, CurrentTime where (Categories.ItemID = Items.ItemID) AND (IFNULL($category, "") = "" OR $category = Categories.category) AND (IFNULL($itemID, "") = "" OR $itemID = Items.ItemID) AND (IFNULL($userID, "") = "" OR $userID = Items.Seller_UserID) AND (Items.Description LIKE $description) AND (IFNULL(Items.Currently, Items.First_Bid) >= $minPrice) AND (IFNULL(Items.Currently, Items.First_Bid) <= $maxPrice) AND (Items.Started > CurrentTime.Time) group by Items.ItemID'
-    #No additional parameters specified if all auctions are searched.
-    elif status == 'all':
-        query_string = 'select Items.ItemID, Items.Name, Categories.category as Categories, Items.Started as "Start Time", Items.Ends as "End Time", CurrentTime.Time as "Current Time", Items.First_Bid as "First Bid", Items.Currently as "Current Price", Items.Number_of_Bids as "Number of Bids", Items.Buy_Price as "Buy Price", Items.Seller_UserID as "Seller ID", Items.Description, group_concat(category,", ") as Category from Items, Categories, CurrentTime where (Categories.ItemID = Items.ItemID) AND (IFNULL($category, "") = "" OR $category = Categories.category) AND (IFNULL($itemID, "") = "" OR $itemID = Items.ItemID) AND (IFNULL($userID, "") = "" OR $userID = Items.Seller_UserID) AND (Items.Description LIKE $description) AND (IFNULL(Items.Currently, Items.First_Bid) >= $minPrice) AND (IFNULL(Items.Currently, Items.First_Bid) <= $maxPrice) group by Items.ItemID'
-
-    #Organize the query, and return it while catching possible errors.
-    result = query(query_string, {'category': category, 'itemID': itemID, 'userID': userID, 'description': description, 'minPrice': minPrice, 'maxPrice': maxPrice})
+#Get the stored status of an item: 'notStarted', 'open' or 'close' (see status_add.sql)
+def getStatusById(item_id):
+    query_string = 'select Status from ItemStatus where ItemID = $itemID'
+    result = query(query_string, {'itemID': item_id})
     try:
-        return result
+        return result[0].Status
     except IndexError:
         return None
+
+#Convert the description typed on the search page into an FTS5 query for the ItemsSearch index
+#(search_add.sql): every word must appear in the item's name or description, "quoted words" must
+#appear together as a phrase and a word ending in * matches any word starting with it.
+def searchKeywords(description):
+    terms = []
+    for phrase, word in re.findall(r'"([^"]*)"|(\S+)', description):
+        if phrase.strip():
+            terms.append('"%s"' % phrase)
+        elif word.rstrip('*'):
+            prefix = '*' if word.endswith('*') else ''
+            terms.append('"%s"%s' % (word.rstrip('*').replace('"', '""'), prefix))
+    return ' '.join(terms)
+
+#Orders that search results can be paged through. Rows with the same key are ordered by ItemID,
+#so (key, ItemID) gives every row a unique position; each key is the key of an index.
+SEARCH_ORDERS = {
+    'itemID': 'Items.ItemID',
+    'ends': 'Items.Ends',
+    'price': 'IFNULL(Items.Currently, Items.First_Bid)',
+    'relevance': 'ItemsSearch.rank',
+}
+
+#Build the search query and its variables from the parameters that were actually specified.
+#Only supplied parameters become predicates, so each one can be answered from an index in
+#indexes.sql instead of scanning Items x Categories (check with search_plan_verify.py).
+#
+#With an order (a key of SEARCH_ORDERS), the query returns at most limit rows sorted by that key,
+#starting after the (key, ItemID) position `after' and with the key in an extra SortKey column.
+#This pages through results with a keyset instead of OFFSET, so later pages cost the same as the
+#first. Descriptions are left out unless includeDescription is set.
+def buildSearchQuery(userID, itemID, category, description, minPrice, maxPrice, status, order = None, after = None, limit = None, includeDescription = True):
+    vars = {'currentTime': timeFromDb(getTime())}
+    where = []
+    if itemID:
+        where.append('Items.ItemID = $itemID')
+        vars['itemID'] = itemID
+    if userID:
+        where.append('Items.Seller_UserID = $userID')
+        vars['userID'] = userID
+    #Keyword searches start from the full-text index and return the best matches first
+    keywords = searchKeywords(description or '')
+    if keywords:
+        where.append('ItemsSearch MATCH $keywords')
+        vars['keywords'] = keywords
+        tables = 'ItemsSearch join Items on Items.ItemID = ItemsSearch.rowid'
+        orderBy = ' order by ItemsSearch.rank'
+    else:
+        tables = 'Items'
+        orderBy = ''
+    #The status of every item is kept up to date in ItemStatus, so it is looked up rather than computed.
+    #A page is read in order from the sort key's index with the status looked up for each item, so
+    #the unary + keeps the planner from starting at ItemStatus_Status and sorting every match
+    if status != 'all':
+        where.append(('+' if order is not None else '') + 'ItemStatus.Status = $status')
+        vars['status'] = status
+        tables += ' join ItemStatus on ItemStatus.ItemID = Items.ItemID'
+    if minPrice:
+        where.append('IFNULL(Items.Currently, Items.First_Bid) >= $minPrice')
+        vars['minPrice'] = moneyToDb(minPrice)
+    if maxPrice:
+        where.append('IFNULL(Items.Currently, Items.First_Bid) <= $maxPrice')
+        vars['maxPrice'] = moneyToDb(maxPrice)
+
+    columns = 'Items.ItemID, Items.Name, %s, %s as "Start Time", %s as "End Time", $currentTime as "Current Time", %s as "First Bid", %s as "Current Price", Items.Number_of_Bids as "Number of Bids", %s as "Buy Price", Items.Seller_UserID as "Seller ID", ' + ('Items.Description, ' if includeDescription else '') + '%s'
+    #With a category, drive the query from the Categories_Category index and report the matching category
+    if category:
+        where.append('Categories.Category = $category')
+        vars['category'] = category
+        categories = ('Categories.Category as Categories', 'group_concat(Categories.Category,", ") as Category')
+        tables += ' join Categories on Categories.ItemID = Items.ItemID'
+        groupBy = ' group by Items.ItemID'
+    #Otherwise Categories is only read for the items that are returned
+    else:
+        categories = ('(select Category from Categories where Categories.ItemID = Items.ItemID) as Categories', '(select group_concat(Category,", ") from Categories where Categories.ItemID = Items.ItemID) as Category')
+        groupBy = ''
+    columns = columns % (categories[0], timeColumn('Items.Started'), timeColumn('Items.Ends'), moneyColumn('Items.First_Bid'), moneyColumn('Items.Currently'), moneyColumn('Items.Buy_Price'), categories[1])
+
+    if order is not None:
+        if order == 'relevance' and not keywords:
+            order = 'itemID'
+        key = SEARCH_ORDERS[order]
+        columns += ', %s as SortKey' % key
+        if after is not None and order == 'itemID':
+            where.append('Items.ItemID > $afterID')
+        #The planner does not seek an index on a row value, so the key's own bound is given as well
+        elif after is not None:
+            where.append('%s >= $afterKey AND (%s, Items.ItemID) > ($afterKey, $afterID)' % (key, key))
+        if after is not None:
+            vars['afterKey'], vars['afterID'] = after
+        orderBy = ' order by ' + key if order == 'itemID' else ' order by %s, Items.ItemID' % key
+        orderBy += ' limit $limit'
+        vars['limit'] = limit
+
+    query_string = 'select ' + columns + ' from ' + tables
+    if where:
+        query_string += ' where ' + ' AND '.join(where)
+    return query_string + groupBy + orderBy, vars
+
+#Search results only change when a bid is placed or the current time moves, so newBid and
+#updateTime invalidate the whole search cache
+searchCache = ResultCache(SEARCH_CACHE_SIZE)
+
+#returns the search cache's hit and miss counts, number of entries and version
+def searchCacheStats():
+    return searchCache.stats()
+
+#Normalize search parameters into a cache key, so that searches that build the same query share
+#an entry: empty parameters are left out, prices are compared as stored and descriptions by the
+#full-text query they turn into
+def searchCacheKey(userID, itemID, category, description, minPrice, maxPrice, status):
+    return (userID or None, itemID or None, category or None, searchKeywords(description or '') or None,
+            moneyToDb(minPrice) if minPrice else None, moneyToDb(maxPrice) if maxPrice else None, status)
+
+#Search through the database to retrieve all details of corresponding auctions based on parameters
+def searchAuction(userID, itemID, category, description, minPrice, maxPrice, status):
+    key = ('all',) + searchCacheKey(userID, itemID, category, description, minPrice, maxPrice, status)
+    result = searchCache.get(key)
+    if result is None:
+        version = searchCache.version
+        query_string, vars = buildSearchQuery(userID, itemID, category, description, minPrice, maxPrice, status)
+        result = query(query_string, vars)
+        searchCache.put(key, version, result)
+    return result
+
+#Count the items in each category with the given status (or in any status for 'all') from the
+#category facets (facet_add.sql), most items first. The counts are kept by triggers, so this reads
+#one row per category and status however many items there are. Like search results, the counts
+#change with bids and the current time, so they are kept in the search cache.
+def getCategoryFacets(status = 'all', limit = FACET_LIMIT):
+    key = ('facets', status, limit)
+    result = searchCache.get(key)
+    if result is None:
+        version = searchCache.version
+        query_string = 'select CategoryNames.Category, sum(CategoryFacets.Items) as Items from CategoryFacets join CategoryNames on CategoryNames.CategoryID = CategoryFacets.CategoryID'
+        vars = {'limit': limit}
+        if status != 'all':
+            query_string += ' where CategoryFacets.Status = $status'
+            vars['status'] = status
+        query_string += ' group by CategoryFacets.CategoryID having Items > 0 order by Items desc, CategoryNames.Category limit $limit'
+        result = query(query_string, vars)
+        searchCache.put(key, version, result)
+    return result
+
+#Count the items of one category by status, with their total under 'all'; every count is 0 for a
+#category that no item has
+def getCategoryCounts(category):
+    key = ('categoryCounts', category)
+    result = searchCache.get(key)
+    if result is None:
+        version = searchCache.version
+        query_string = 'select CategoryFacets.Status, CategoryFacets.Items from CategoryFacets join CategoryNames on CategoryNames.CategoryID = CategoryFacets.CategoryID where CategoryNames.Category = $category'
+        result = dict.fromkeys(('notStarted', 'open', 'close'), 0)
+        for row in query(query_string, {'category': category}):
+            result[row.Status] = row.Items
+        result['all'] = sum(result.values())
+        searchCache.put(key, version, result)
+    return result
+
+#Cursors handed to the search page encode the (sort key, ItemID) position of the last row shown
+def encodeCursor(position):
+    return base64.urlsafe_b64encode(json.dumps(position).encode('utf-8')).decode('ascii')
+
+#Sort keys are text, numbers or null and ItemIDs integers (json gives text as unicode in Python 2)
+try:
+    CURSOR_INTEGER_TYPES = (int, long)
+    CURSOR_KEY_TYPES = (basestring, int, long, float)
+except NameError:
+    CURSOR_INTEGER_TYPES = (int,)
+    CURSOR_KEY_TYPES = (str, int, float)
+
+def decodeCursor(cursor, order = None):
+    try:
+        sortKey, itemID = json.loads(base64.urlsafe_b64decode(str(cursor)).decode('utf-8'))
+    except (TypeError, ValueError):
+        raise ValueError('Invalid search cursor')
+    if isinstance(itemID, bool) or not isinstance(itemID, CURSOR_INTEGER_TYPES):
+        raise ValueError('Invalid search cursor')
+    if isinstance(sortKey, bool) or not (sortKey is None or isinstance(sortKey, CURSOR_KEY_TYPES)):
+        raise ValueError('Invalid search cursor')
+    #paging by ItemID, the sort key is the ItemID itself
+    if order == 'itemID' and sortKey != itemID:
+        raise ValueError('Invalid search cursor')
+    return sortKey, itemID
+
+#One page of search results. Iterating over it streams the rows from the database; once all rows
+#have been read, nextCursor is the cursor of the following page, or None on the last page, and
+#onComplete (if given) is called with the rows of the page and nextCursor.
+class SearchPage(object):
+    def __init__(self, rows, pageSize, onComplete = None):
+        self.rows = rows
+        self.pageSize = pageSize
+        self.onComplete = onComplete
+        self.nextCursor = None
+
+    def __iter__(self):
+        count = 0
+        page = []
+        for row in self.rows:
+            position = (row.pop('SortKey'), row.ItemID)
+            count += 1
+            #the query asks for one row more than a page to find out whether another page follows
+            if count > self.pageSize:
+                self.nextCursor = encodeCursor(lastPosition)
+                break
+            lastPosition = position
+            page.append(row)
+            yield row
+        if self.onComplete is not None:
+            self.onComplete(page, self.nextCursor)
+
+#A page of search results served from the search cache
+class CachedSearchPage(object):
+    def __init__(self, rows, nextCursor):
+        self.rows = rows
+        self.nextCursor = nextCursor
+
+    def __iter__(self):
+        return iter(self.rows)
+
+#Search like searchAuction, but return one page of results in the given order (a key of
+#SEARCH_ORDERS, by default relevance for keyword searches and ItemID otherwise), starting after the
+#position encoded in cursor. Rows are read from the database only as the page is iterated over,
+#and a page that was read to the end is added to the search cache.
+def searchAuctionPage(userID, itemID, category, description, minPrice, maxPrice, status, cursor = None, pageSize = SEARCH_PAGE_SIZE, order = None, includeDescription = True):
+    pageSize = max(1, min(int(pageSize), MAX_SEARCH_PAGE_SIZE))
+    if order not in SEARCH_ORDERS:
+        order = 'relevance' if searchKeywords(description or '') else 'itemID'
+    after = decodeCursor(cursor, order) if cursor else None
+    key = ('page', order, after, pageSize, bool(includeDescription)) + searchCacheKey(userID, itemID, category, description, minPrice, maxPrice, status)
+    cached = searchCache.get(key)
+    if cached is not None:
+        return CachedSearchPage(*cached)
+    version = searchCache.version
+    def store(rows, nextCursor):
+        searchCache.put(key, version, (rows, nextCursor))
+    query_string, vars = buildSearchQuery(userID, itemID, category, description, minPrice, maxPrice, status, order, after, pageSize + 1, includeDescription)
+    return SearchPage(iterQuery(query_string, vars), pageSize, store)